@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Compare the upload engines at increasing concurrency levels: threads
+(upload_video.upload on an UploadScheduler, one httplib2 connection per
+thread) and asyncio (aio.upload_all, a single event loop). The mock API
+(mock_youtube.py) runs in its own process, so the CPU time and the threads
+measured are the ones of the client.
+
+    $ python benchmarks/aio_upload.py [--size-mb=N] [--videos=N] [--chunksize-mb=N]
+                                      [--parallel=4,16,48] [--latency=S]
+"""
+import os
+import sys
+import time
+import socket
+import optparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from youtube_upload import aio
+from youtube_upload import auth
+from youtube_upload import lib
+from youtube_upload import upload_video
+from youtube_upload.scheduler import UploadScheduler
+
+ENGINES = ["threads", "asyncio"]
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(options):
+    """Run the mock API in a child process and return (process, URL)."""
+    port = get_free_port()
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mock_youtube.py")
+    process = subprocess.Popen([sys.executable, script, "--port={0}".format(port),
+                                "--latency={0}".format(options.latency)],
+                               stderr=subprocess.PIPE)
+    process.stderr.readline()
+    return process, "http://127.0.0.1:{0}".format(port)
+
+
+def get_resource(url):
+    import json
+    import httplib2
+    import googleapiclient.discovery
+
+    document = json.loads(auth.get_discovery_document())
+    document["rootUrl"] = url + "/"
+    http = httplib2.Http()
+    http.redirect_codes = http.redirect_codes - {308}
+    return googleapiclient.discovery.build_from_document(document, http=http)
+
+
+def upload_job(youtube, path, chunksize):
+    return upload_video.upload(youtube, path, dict(snippet=dict(title="Video")),
+                               chunksize=chunksize)
+
+
+def run_threads(url, paths, chunksize, parallel):
+    scheduler = UploadScheduler(lambda: get_resource(url), workers=parallel)
+    try:
+        jobs = [scheduler.submit(upload_job, path, chunksize) for path in paths]
+        return [job.result() for job in jobs]
+    finally:
+        scheduler.shutdown()
+
+
+def run_asyncio(url, paths, chunksize, parallel):
+    uploads = [dict(path=path, body=dict(snippet=dict(title="Video")), chunksize=chunksize)
+               for path in paths]
+    results = aio.upload_all(None, uploads, concurrency=parallel, root_url=url + "/")
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+class ThreadCounter(object):
+    """Sample the number of threads of the process (peak, excluding the sampler)."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run(options, engine, paths, parallel):
+    """Upload the videos with an engine and return a dictionary of results."""
+    process, url = start_server(options)
+    run_engine = {"threads": run_threads, "asyncio": run_asyncio}[engine]
+    try:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        with ThreadCounter() as counter:
+            run_engine(url, paths, options.chunksize_mb * 1024 * 1024, parallel)
+        elapsed = time.time() - start
+        cpu = sum(resource.getrusage(resource.RUSAGE_SELF)[:2]) - sum(usage[:2])
+    finally:
+        process.terminate()
+        process.wait()
+    megabytes = len(paths) * options.size_mb
+    return dict(seconds=elapsed, rate=megabytes / elapsed, cpu=cpu, threads=counter.peak)
+
+
+def parse_list(option, option_string, value, parser):
+    setattr(parser.values, option.dest, [int(item) for item in value.split(",")])
+
+
+def main(arguments):
+    parser = optparse.OptionParser("Usage: %prog [OPTIONS]")
+    parser.add_option('', '--size-mb', dest='size_mb', type="int", default=4,
+                      help='Size of every video (default: 4 MiB)')
+    parser.add_option('', '--videos', dest='videos', type="int", default=48,
+                      help='Number of videos uploaded in every run (default: 48)')
+    parser.add_option('', '--chunksize-mb', dest='chunksize_mb', type="int", default=1,
+                      help='Chunk size (default: 1 MiB)')
+    parser.add_option('', '--parallel', dest='parallel', type="string",
+                      action="callback", callback=parse_list, default=[4, 16, 48],
+                      metavar="N,...", help='Concurrency levels to compare (default: 4,16,48)')
+    parser.add_option('', '--latency', dest='latency', type="float", default=0.05,
+                      metavar="SECONDS", help='Latency of every response (default: 0.05)')
+    options, args = parser.parse_args(arguments)
+    lib.set_retry_policy(lib.RetryPolicy(base=0.1, max_sleep=1.0))
+    # Build the discovery document once, not on the first measured run
+    auth.get_discovery_document()
+
+    paths = []
+    try:
+        block = os.urandom(1024 * 1024)
+        for _ in range(options.videos):
+            fd, path = tempfile.mkstemp()
+            paths.append(path)
+            with os.fdopen(fd, "wb") as output:
+                for _ in range(options.size_mb):
+                    output.write(block)
+        print("{0:>8} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}".format(
+            "engine", "parallel", "seconds", "MB/s", "cpu", "threads"))
+        for parallel in options.parallel:
+            for engine in ENGINES:
+                result = run(options, engine, paths, parallel)
+                print("{0:>8} {1:>8} {seconds:>8.2f} {rate:>8.1f} {cpu:>8.2f} "
+                      "{threads:>8}".format(engine, parallel, **result))
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
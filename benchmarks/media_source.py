@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Compare CPU time and memory (max RSS) per GB of the media sources of an
+upload: MediaFileUpload (googleapiclient) and MmapMediaUpload (mmap). Each
+source uploads a temporary file to a local server in its own process.
+
+    $ python benchmarks/media_source.py [--size-mb=N] [--chunksize-mb=N]
+"""
+import os
+import sys
+import json
+import optparse
+import resource
+import tempfile
+import subprocess
+
+from mock_youtube import MockYoutubeServer  # Adds the repository to sys.path
+
+SOURCES = ["file", "mmap"]
+
+
+def upload(source, url, path, chunksize):
+    """Upload path to url using a media source (run in the child process)."""
+    import httplib2
+    import apiclient.http
+    from youtube_upload import upload_video
+
+    if source == "mmap":
+        media = upload_video.MmapMediaUpload(path, chunksize)
+    else:
+        media = apiclient.http.MediaFileUpload(path, chunksize=chunksize, resumable=True,
+                                               mimetype="application/octet-stream")
+    http = httplib2.Http()
+    http.redirect_codes = http.redirect_codes - {308}
+    request = apiclient.http.HttpRequest(http, lambda resp, content: json.loads(content),
+                                         url, method="POST", body="{}",
+                                         headers={"content-type": "application/json"},
+                                         resumable=media)
+    upload_video._upload_to_request(request, None)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print(json.dumps(dict(cpu=usage.ru_utime + usage.ru_stime, maxrss_mb=get_maxrss_mb(usage))))
+
+
+def get_maxrss_mb(usage):
+    """
+    Return the peak RSS (MiB) of this process. On Linux, ru_maxrss keeps the
+    peak of the parent process at fork time, so read VmHWM instead.
+    """
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    # ru_maxrss is in KiB on Linux, bytes on OS X
+    return usage.ru_maxrss / (1024.0 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def main(arguments):
+    parser = optparse.OptionParser("Usage: %prog [--size-mb=N] [--chunksize-mb=N]")
+    parser.add_option('', '--size-mb', dest='size_mb', type="int", default=1024,
+                      help='Size of the uploaded file (default: 1024 MiB)')
+    parser.add_option('', '--chunksize-mb', dest='chunksize_mb', type="int", default=64,
+                      help='Chunk size (default: 64 MiB)')
+    parser.add_option('', '--child', dest='child', type="string", help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(arguments)
+    chunksize = options.chunksize_mb * 1024 * 1024
+
+    if options.child:
+        source, url, path = options.child.split(",", 2)
+        return upload(source, url, path, chunksize)
+
+    server = MockYoutubeServer().start()
+    url = server.url + "/upload/youtube/v3/videos?uploadType=resumable"
+
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1024 * 1024)
+        with os.fdopen(fd, "wb") as output:
+            for _ in range(options.size_mb):
+                output.write(block)
+        gigabytes = options.size_mb / 1024.0
+        for source in SOURCES:
+            output = subprocess.check_output(
+                [sys.executable, __file__, "--chunksize-mb", str(options.chunksize_mb),
+                 "--child", ",".join([source, url, path])])
+            result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            print("{0:<5} cpu={1:.2f}s/GB maxrss={2:.0f}MB".format(
+                source, result["cpu"] / gigabytes, result["maxrss_mb"]))
+    finally:
+        os.remove(path)
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
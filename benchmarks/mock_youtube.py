@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Youtube API, to test and benchmark uploads without
+network access. It implements:
+
+  - Resumable uploads of videos (308 Resume Incomplete, Range headers,
+    status queries, 404 for unknown sessions).
+  - Videos (list, update), thumbnails (thumbnails.set), channels (list),
+    playlists (list, insert) and playlist items (list, insert, update; with
+    manualSortRequired errors for the automatic_playlists). Lists are
+    paginated, with etags (304 Not Modified on If-None-Match), and the
+    uploads playlist (UPLOADS_PLAYLIST_ID) lists the uploaded videos.
+  - Batch requests (multipart/mixed) of the calls above.
+
+Uploaded data is discarded. Network conditions are injectable: latency of
+every response, bandwidth cap of the request bodies (shared by all
+connections, as an uplink) and failure rate (503 errors; failed chunks keep
+part of their data, so clients must resume from the Range of the server).
+
+    $ python benchmarks/mock_youtube.py [--port=N] [--latency=S] [--bandwidth=RATE]
+                                        [--failure-rate=F]
+
+Use MockYoutubeServer(...).get_resource() to get an API resource for the server.
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import time
+import random
+import optparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+# Failed chunks keep their data up to a multiple of this size
+CHUNK_MULTIPLE = 256 * 1024
+READ_SIZE = 64 * 1024
+PAGE_SIZE = 5
+UPLOADS_PLAYLIST_ID = "UU1"
+
+
+class Pacer(object):
+    """Limit the rate (bytes/second) of the data read by all threads."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def consume(self, size):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + size / float(self.rate)
+            wait = self.next_time - now
+        time.sleep(wait)
+
+
+class Response(object):
+    """HTTP response, body is a JSON object or raw bytes."""
+
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.headers = dict(headers or {})
+        if isinstance(body, bytes):
+            self.body = body
+        elif body is not None:
+            self.body = json.dumps(body).encode("utf-8")
+            self.headers["Content-Type"] = "application/json"
+        else:
+            self.body = b""
+
+
+def error_response(status, reason, message=""):
+    error = dict(code=status, message=message, errors=[dict(reason=reason, message=message)])
+    return Response(status, dict(error=error))
+
+
+def get_page(items, query, kind, headers=None):
+    """Return a paginated list response of items (304 if the etag matches If-None-Match)."""
+    size = min(int(query.get("maxResults", PAGE_SIZE)), PAGE_SIZE)
+    start = int(query.get("pageToken", 0))
+    response = dict(kind=kind, items=items[start:start + size],
+                    pageInfo=dict(totalResults=len(items), resultsPerPage=size))
+    if start + size < len(items):
+        response["nextPageToken"] = str(start + size)
+    etag = hashlib.md5(json.dumps(response, sort_keys=True).encode("utf-8")).hexdigest()
+    if (headers or {}).get("If-None-Match") == etag:
+        return Response(304)
+    response["etag"] = etag
+    return Response(200, response)
+
+
+class MockYoutubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        """Read the request body (at the bandwidth of the server) and return it."""
+        remaining = int(self.headers.get("Content-Length") or 0)
+        blocks = []
+        while remaining > 0:
+            if self.server.pacer:
+                self.server.pacer.consume(min(remaining, READ_SIZE))
+            block = self.rfile.read(min(remaining, READ_SIZE))
+            if not block:
+                break
+            remaining -= len(block)
+            blocks.append(block)
+        return b"".join(blocks)
+
+    def _respond(self, response):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(response.status)
+        for key, value in response.headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def _handle(self):
+        body = self._read_body()
+        self._respond(self.server.dispatch(self.command, self.path, self.headers, body))
+
+    do_GET = do_POST = do_PUT = _handle
+
+
+class MockYoutubeServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server with the state of the mock API (see module docstring)."""
+    daemon_threads = True
+    # Many clients connect at the same time (the default backlog is 5)
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None, failure_rate=0.0, seed=None):
+        HTTPServer.__init__(self, ("127.0.0.1", port), MockYoutubeHandler)
+        self.latency = latency
+        self.pacer = (Pacer(bandwidth) if bandwidth else None)
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.videos = {}
+        self.thumbnails = {}
+        self.playlists = []
+        self.playlist_items = []
+        # IDs of the playlists not sorted manually (items cannot be placed at a position)
+        self.automatic_playlists = set()
+        self.stats = dict(requests={}, failures=0, bytes=0)
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}".format(self.server_port)
+
+    def start(self):
+        """Serve requests in a background thread and return the server."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def get_resource(self):
+        """Return a new API resource (with its own HTTP object) that uses this server."""
+        import httplib2
+        import googleapiclient.discovery
+        from youtube_upload import auth
+
+        document = json.loads(auth.get_discovery_document())
+        document["rootUrl"] = self.url + "/"
+        http = httplib2.Http()
+        http.redirect_codes = http.redirect_codes - {308}
+        return googleapiclient.discovery.build_from_document(document, http=http)
+
+    def _new_id(self, prefix, collection):
+        return "{0}{1}".format(prefix, len(collection) + 1)
+
+    def _fail(self):
+        return self.failure_rate and self.random.random() < self.failure_rate
+
+    def dispatch(self, method, path, headers, body):
+        """Process a request and return a Response."""
+        url = urlparse(path)
+        query = dict((key, values[0]) for (key, values) in parse_qs(url.query).items())
+        name = "{0} {1}".format(method, url.path)
+        with self.lock:
+            self.stats["requests"][name] = self.stats["requests"].get(name, 0) + 1
+            self.stats["bytes"] += len(body)
+        if url.path in ("/batch", "/batch/youtube/v3"):
+            return self.batch(headers, body)
+        elif url.path == "/upload/youtube/v3/videos" and method == "PUT":
+            return self.upload_chunk(query, headers, body)
+        elif self._fail():
+            with self.lock:
+                self.stats["failures"] += 1
+            return error_response(503, "backendError", "Injected failure")
+        elif url.path == "/upload/youtube/v3/videos" and method == "POST":
+            return self.start_upload(query, headers, body)
+        elif url.path == "/upload/youtube/v3/thumbnails/set":
+            return self.set_thumbnail(query, body)
+        elif url.path == "/youtube/v3/videos" and method == "GET":
+            return self.list_videos(query)
+        elif url.path == "/youtube/v3/videos" and method == "PUT":
+            return self.update_video(query, json.loads(body.decode("utf-8")))
+        elif url.path == "/youtube/v3/channels" and method == "GET":
+            uploads = dict(relatedPlaylists=dict(uploads=UPLOADS_PLAYLIST_ID))
+            return Response(200, dict(items=[dict(id="UC1", contentDetails=uploads)]))
+        elif url.path == "/youtube/v3/playlists" and method == "GET":
+            return get_page(self.playlists, query, "youtube#playlistListResponse", headers)
+        elif url.path == "/youtube/v3/playlists" and method == "POST":
+            return self.insert(self.playlists, "PL", json.loads(body.decode("utf-8")))
+        elif url.path == "/youtube/v3/playlistItems" and method == "GET":
+            playlist_id = query.get("playlistId")
+            if playlist_id == UPLOADS_PLAYLIST_ID:
+                items = self.get_uploads()
+            else:
+                items = [item for item in self.playlist_items
+                         if item["snippet"]["playlistId"] == playlist_id]
+            return get_page(items, query, "youtube#playlistItemListResponse", headers)
+        elif url.path == "/youtube/v3/playlistItems" and method == "POST":
+            return self.insert_playlist_item(json.loads(body.decode("utf-8")))
+        elif url.path == "/youtube/v3/playlistItems" and method == "PUT":
+            return self.update_playlist_item(json.loads(body.decode("utf-8")))
+        else:
+            return error_response(404, "notFound", "Unknown path: " + name)
+
+    def insert(self, collection, prefix, resource):
+        with self.lock:
+            resource["id"] = self._new_id(prefix, collection)
+            collection.append(resource)
+        return Response(200, resource)
+
+    def insert_video(self, resource):
+        with self.lock:
+            resource["id"] = self._new_id("video", self.videos)
+            self.videos[resource["id"]] = resource
+        return Response(200, resource)
+
+    def get_uploads(self):
+        """Return the items of the uploads playlist (the last uploaded video first)."""
+        with self.lock:
+            videos = sorted(self.videos.values(), key=lambda video: -int(video["id"][5:]))
+        return [dict(id="UU" + video["id"], snippet=dict(
+                    playlistId=UPLOADS_PLAYLIST_ID, position=position,
+                    title=video.get("snippet", {}).get("title"),
+                    resourceId=dict(kind="youtube#video", videoId=video["id"])))
+                for (position, video) in enumerate(videos)]
+
+    def list_videos(self, query):
+        parts = query.get("part", "").split(",")
+        items = []
+        for video_id in query.get("id", "").split(","):
+            if video_id in self.videos:
+                video = self.videos[video_id]
+                items.append(dict((key, value) for (key, value) in video.items()
+                                  if key in parts or key == "id"))
+        return Response(200, dict(kind="youtube#videoListResponse", items=items))
+
+    def update_video(self, query, resource):
+        video = self.videos.get(resource.get("id"))
+        if not video:
+            return error_response(404, "videoNotFound")
+        with self.lock:
+            for part in query.get("part", "").split(","):
+                video[part] = resource.get(part, {})
+        return Response(200, video)
+
+    def insert_playlist_item(self, resource):
+        snippet = resource.get("snippet", {})
+        playlist_ids = [playlist["id"] for playlist in self.playlists]
+        if snippet.get("playlistId") not in playlist_ids:
+            return error_response(404, "playlistNotFound")
+        elif snippet.get("resourceId", {}).get("videoId") not in self.videos:
+            return error_response(404, "videoNotFound")
+        elif "position" in snippet and snippet["playlistId"] in self.automatic_playlists:
+            return error_response(400, "manualSortRequired")
+        with self.lock:
+            items = [item for item in self.playlist_items
+                     if item["snippet"]["playlistId"] == snippet["playlistId"]]
+            snippet["position"] = min(snippet.get("position", len(items)), len(items))
+            for item in items:
+                if item["snippet"]["position"] >= snippet["position"]:
+                    item["snippet"]["position"] += 1
+            resource["id"] = self._new_id("PLI", self.playlist_items)
+            self.playlist_items.append(resource)
+            self.playlist_items.sort(key=lambda item: item["snippet"]["position"])
+        return Response(200, resource)
+
+    def update_playlist_item(self, resource):
+        """Move a playlist item to the position of its snippet."""
+        with self.lock:
+            matches = [item for item in self.playlist_items if item["id"] == resource.get("id")]
+            if not matches:
+                return error_response(404, "playlistItemNotFound")
+            item = matches[0]
+            if item["snippet"]["playlistId"] in self.automatic_playlists:
+                return error_response(400, "manualSortRequired")
+            items = [other for other in self.playlist_items
+                     if other["snippet"]["playlistId"] == item["snippet"]["playlistId"]]
+            items.remove(item)
+            position = min(resource.get("snippet", {}).get("position", len(items)), len(items))
+            items.insert(position, item)
+            for index, other in enumerate(items):
+                other["snippet"]["position"] = index
+            self.playlist_items.sort(key=lambda item: item["snippet"]["position"])
+        return Response(200, item)
+
+    def set_thumbnail(self, query, body):
+        video_id = query.get("videoId")
+        if video_id not in self.videos:
+            return error_response(404, "videoNotFound")
+        elif len(body) > 2 * 1024 * 1024:
+            return error_response(413, "mediaBodyTooLarge", "The thumbnail is larger than 2 MB")
+        url = "{0}/thumbnails/{1}.jpg".format(self.url, video_id)
+        self.thumbnails[video_id] = url
+        return Response(200, dict(items=[dict(default=dict(url=url))]))
+
+    def start_upload(self, query, headers, body):
+        if query.get("uploadType") != "resumable":
+            return error_response(400, "invalidUploadType", "Only resumable uploads")
+        with self.lock:
+            session_id = str(len(self.sessions) + 1)
+            self.sessions[session_id] = dict(offset=0, metadata=json.loads(body.decode("utf-8")))
+        location = "{0}/upload/youtube/v3/videos?uploadType=resumable&upload_id={1}".format(
+            self.url, session_id)
+        return Response(200, headers={"Location": location})
+
+    def upload_chunk(self, query, headers, body):
+        session = self.sessions.get(query.get("upload_id"))
+        match = re.match(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)",
+                         headers.get("Content-Range") or "bytes */*")
+        if not session:
+            return error_response(404, "notFound", "Unknown upload session")
+        elif not match:
+            return error_response(400, "badContentRange")
+        start, end, total = match.groups()
+        if start is not None and int(start) == session["offset"]:
+            if self._fail():
+                # Keep part of the chunk, the client must resume from the Range header
+                kept = (len(body) // 2) // CHUNK_MULTIPLE * CHUNK_MULTIPLE
+                with self.lock:
+                    self.stats["failures"] += 1
+                    session["offset"] += kept
+                return error_response(503, "backendError", "Injected failure")
+            session["offset"] = int(end) + 1
+        if total != "*" and session["offset"] == int(total):
+            return self.insert_video(session["metadata"])
+        elif session["offset"]:
+            return Response(308, headers={"Range": "bytes=0-{0}".format(session["offset"] - 1)})
+        else:
+            return Response(308)
+
+    def batch(self, headers, body):
+        """Process the requests of a multipart/mixed batch request."""
+        boundary = re.search(r'boundary="?([^";]+)"?', headers.get("Content-Type", "")).group(1)
+        parts = []
+        # Parts may use LF or CRLF line endings
+        body = body.replace(b"\r\n", b"\n")
+        for part in body.split(b"--" + boundary.encode("ascii"))[1:-1]:
+            part_headers, request = part.strip(b"\n").split(b"\n\n", 1)
+            content_id = re.search(b"Content-ID: <([^>]*)>", part_headers).group(1)
+            request_line_and_headers, request_body = (request.split(b"\n\n", 1) + [b""])[:2]
+            lines = request_line_and_headers.decode("utf-8").split("\n")
+            method, path = lines[0].split(" ")[:2]
+            request_headers = dict(line.split(": ", 1) for line in lines[1:] if line)
+            response = self.dispatch(method, path, request_headers, request_body)
+            parts.append(b"\r\n".join([
+                b"--BATCH",
+                b"Content-Type: application/http",
+                b"Content-ID: <response-" + content_id + b">",
+                b"",
+                "HTTP/1.1 {0} Status".format(response.status).encode("ascii"),
+                "Content-Type: application/json".encode("ascii"),
+                b"",
+                response.body,
+            ]))
+        content = b"\r\n".join(parts + [b"--BATCH--", b""])
+        return Response(200, content, {"Content-Type": "multipart/mixed; boundary=BATCH"})
+
+
+def main(arguments):
+    from youtube_upload import throttle
+
+    parser = optparse.OptionParser("Usage: %prog [OPTIONS]")
+    parser.add_option('', '--port', dest='port', type="int", default=8080,
+                      help='Port to listen on (default: 8080)')
+    parser.add_option('', '--latency', dest='latency', type="float", default=0.0,
+                      metavar="SECONDS", help='Latency of every response (default: 0)')
+    parser.add_option('', '--bandwidth', dest='bandwidth', type="string", metavar="RATE",
+                      help='Bandwidth cap of the uploads in bytes/second (e.g. 10M)')
+    parser.add_option('', '--failure-rate', dest='failure_rate', type="float", default=0.0,
+                      help='Fraction of requests that fail with 503 (default: 0)')
+    options, args = parser.parse_args(arguments)
+
+    bandwidth = (throttle.parse_rate(options.bandwidth) if options.bandwidth else None)
+    server = MockYoutubeServer(options.port, options.latency, bandwidth, options.failure_rate)
+    sys.stderr.write("Serving on {0}\n".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
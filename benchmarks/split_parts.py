@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Check the split of videos with small clips generated by ffmpeg (lavfi test
+source): two videos with the same basename are split concurrently into the
+same directory, their parts must not collide, cover the whole clip, and be
+deleted only by their own splitter. Parts are cut at keyframes (stream copy),
+so a part may start up to a GOP (GOP_SECONDS in the clips, plus the B-frame
+delay) before its offset. Report the time spent cutting. The check is skipped
+(exit code 0) if ffmpeg or ffprobe are not installed.
+
+    $ python benchmarks/split_parts.py [--duration=S] [--part-duration=S]
+"""
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from youtube_upload import split
+
+# Seconds between keyframes in the generated clips
+GOP_SECONDS = 1
+
+
+def has_command(name):
+    try:
+        subprocess.call([name, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return False
+    return True
+
+
+def generate_clip(path, duration):
+    """Write a clip of duration seconds (test pattern, keyframe every GOP_SECONDS)."""
+    subprocess.check_call(["ffmpeg", "-v", "error", "-f", "lavfi", "-i",
+                           "testsrc=duration={0}:size=160x120:rate=10".format(duration),
+                           "-g", str(10 * GOP_SECONDS), "-y", path])
+
+
+def split_video(path, part_duration, directory, results):
+    """Split a video, record its parts (path, duration) and release them."""
+    splitter = split.VideoSplitter(path, part_duration, directory)
+    parts = []
+    for part_path in splitter:
+        parts.append((part_path, split.get_duration(part_path)))
+        # Give the other splitter time to cut its parts while this one exists
+        time.sleep(0.1)
+        splitter.release(part_path)
+        assert not os.path.exists(part_path), "part not released: " + part_path
+    results[path] = (splitter.total, parts)
+
+
+def main(arguments):
+    parser = optparse.OptionParser("Usage: %prog [OPTIONS]")
+    parser.add_option('', '--duration', dest='duration', type="int", default=10,
+                      help='Duration of the generated clips (default: 10 seconds)')
+    parser.add_option('', '--part-duration', dest='part_duration', type="int", default=3,
+                      help='Duration of the parts (default: 3 seconds)')
+    options, args = parser.parse_args(arguments)
+    missing = [name for name in ["ffmpeg", "ffprobe"] if not has_command(name)]
+    if missing:
+        print("Skipped: {0} not installed".format(", ".join(missing)))
+        return
+
+    directory = tempfile.mkdtemp(prefix="split-parts-")
+    try:
+        paths = []
+        for name in ["a", "b"]:
+            os.mkdir(os.path.join(directory, name))
+            path = os.path.join(directory, name, "clip.mkv")
+            generate_clip(path, options.duration)
+            paths.append(path)
+        parts_directory = os.path.join(directory, "parts")
+        os.mkdir(parts_directory)
+
+        results = {}
+        start = time.time()
+        threads = [threading.Thread(target=split_video,
+                                    args=(path, options.part_duration, parts_directory, results))
+                   for path in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        assert len(results) == len(paths), "a splitter failed"
+        part_paths = [part_path for (total, parts) in results.values()
+                      for (part_path, duration) in parts]
+        assert len(set(part_paths)) == len(part_paths), "parts collide: {0}".format(part_paths)
+        for path, (total, parts) in sorted(results.items()):
+            assert len(parts) == total, "{0}: {1} of {2} parts".format(path, len(parts), total)
+            covered = sum(duration for (part_path, duration) in parts)
+            assert covered >= options.duration - 0.5, \
+                "{0}: parts cover {1} of {2} seconds".format(path, covered, options.duration)
+            for part_path, duration in parts:
+                assert duration <= options.part_duration + GOP_SECONDS + 0.5, \
+                    "{0}: part of {1} seconds".format(part_path, duration)
+            print("{0}: {1} parts, {2:.1f} seconds".format(path, total, covered))
+        print("OK: {0} parts cut in {1:.2f} seconds".format(len(part_paths), elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
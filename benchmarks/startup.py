@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Measure the startup time of youtube-upload:
+
+  - help: run "youtube-upload --help".
+  - build (cold): build the API resource with an empty cache (the discovery
+    document is downloaded).
+  - build (warm): build the API resource with the discovery document cached.
+
+    $ python benchmarks/startup.py [--runs=N]
+"""
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+
+BUILD_CODE = """
+import httplib2
+from youtube_upload import auth
+auth.build_resource(httplib2.Http())
+"""
+
+
+def run(args, env):
+    """Run a Python process and return the elapsed time (in seconds)."""
+    start = time.time()
+    subprocess.check_call([sys.executable] + args, env=env, cwd=ROOT,
+                          stdout=subprocess.DEVNULL)
+    return time.time() - start
+
+
+def measure(name, runs, args, get_env):
+    times = sorted(run(args, get_env()) for _ in range(runs))
+    print("{0:<14} min={1:.3f}s median={2:.3f}s max={3:.3f}s".format(
+        name, times[0], times[len(times) // 2], times[-1]))
+
+
+def main(arguments):
+    parser = optparse.OptionParser("Usage: %prog [--runs=N]")
+    parser.add_option('', '--runs', dest='runs', type="int", default=10,
+                      help='Number of runs for each measure (default: 10)')
+    options, args = parser.parse_args(arguments)
+
+    cache_home = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=ROOT, XDG_CACHE_HOME=cache_home)
+
+    def get_empty_cache_env():
+        shutil.rmtree(cache_home)
+        os.makedirs(cache_home)
+        return env
+
+    try:
+        measure("help", options.runs, ["-m", "youtube_upload", "--help"], lambda: env)
+        measure("build (cold)", options.runs, ["-c", BUILD_CODE], get_empty_cache_env)
+        measure("build (warm)", options.runs, ["-c", BUILD_CODE], lambda: env)
+    finally:
+        shutil.rmtree(cache_home)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
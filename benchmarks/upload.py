@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Measure end-to-end uploads against the local mock API (mock_youtube.py) for
+combinations of chunk sizes and concurrency levels: wall time, throughput,
+chunks, retries (and failures injected by the server). Optionally, every
+video is also added to a playlist and gets a thumbnail.
+
+    $ python benchmarks/upload.py [--size-mb=N] [--videos=N] [--chunksizes-mb=1,4,16]
+                                  [--parallel=1,4] [--latency=S] [--bandwidth=RATE]
+                                  [--failure-rate=F] [--playlist] [--thumbnail]
+"""
+import os
+import sys
+import json
+import time
+import optparse
+import tempfile
+
+from mock_youtube import MockYoutubeServer  # Adds the repository to sys.path
+
+from youtube_upload import lib
+from youtube_upload import metrics
+from youtube_upload import playlists
+from youtube_upload import throttle
+from youtube_upload import upload_video
+from youtube_upload.scheduler import UploadScheduler
+
+# Only the JPEG markers, the mock API does not decode thumbnails
+THUMBNAIL = b"\xff\xd8\xff\xd9"
+
+
+def upload_job(youtube, options, path, thumbnail_path, playlist_cache, index):
+    """Upload a video and run its follow-up calls (playlist, thumbnail)."""
+    body = dict(snippet=dict(title="Video {0}".format(index)),
+                status=dict(privacyStatus="private"))
+    video_id = upload_video.upload(youtube, path, body, chunksize=options.chunksize)
+    if options.playlist:
+        playlists.add_video_to_playlist(youtube, video_id, "Benchmark", privacy="private",
+                                        cache=playlist_cache)
+    if options.thumbnail:
+        lib.execute(youtube.thumbnails().set(videoId=video_id, media_body=thumbnail_path))
+    return video_id
+
+
+def run(options, path, thumbnail_path, parallel):
+    """Upload the videos to a new mock server and return a dictionary of results."""
+    server = MockYoutubeServer(latency=options.latency, bandwidth=options.bandwidth,
+                               failure_rate=options.failure_rate, seed=options.seed).start()
+    fd, metrics_path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    metrics.enable(metrics_path, "jsonl")
+    scheduler = UploadScheduler(server.get_resource, workers=parallel)
+    playlist_cache = playlists.PlaylistCache()
+    try:
+        start = time.time()
+        jobs = [scheduler.submit(upload_job, options, path, thumbnail_path, playlist_cache, index)
+                for index in range(options.videos)]
+        for job in jobs:
+            job.result()
+        elapsed = time.time() - start
+    finally:
+        scheduler.shutdown()
+        metrics.disable()
+        server.stop()
+    with open(metrics_path) as fd:
+        events = [json.loads(line)["event"] for line in fd]
+    os.remove(metrics_path)
+    megabytes = options.videos * options.size_mb
+    return dict(seconds=elapsed, rate=megabytes / elapsed, chunks=events.count("chunk"),
+                retries=events.count("retry"), failures=server.stats["failures"],
+                requests=sum(server.stats["requests"].values()))
+
+
+def parse_list(option, option_string, value, parser, type=int):
+    setattr(parser.values, option.dest, [type(item) for item in value.split(",")])
+
+
+def main(arguments):
+    parser = optparse.OptionParser("Usage: %prog [OPTIONS]")
+    parser.add_option('', '--size-mb', dest='size_mb', type="int", default=32,
+                      help='Size of every video (default: 32 MiB)')
+    parser.add_option('', '--videos', dest='videos', type="int", default=4,
+                      help='Number of videos uploaded in every run (default: 4)')
+    parser.add_option('', '--chunksizes-mb', dest='chunksizes_mb', type="string",
+                      action="callback", callback=parse_list, default=[1, 4, 16],
+                      metavar="N,...", help='Chunk sizes to compare (default: 1,4,16)')
+    parser.add_option('', '--parallel', dest='parallel', type="string",
+                      action="callback", callback=parse_list, default=[1, 4],
+                      metavar="N,...", help='Concurrency levels to compare (default: 1,4)')
+    parser.add_option('', '--latency', dest='latency', type="float", default=0.02,
+                      metavar="SECONDS", help='Latency of every response (default: 0.02)')
+    parser.add_option('', '--bandwidth', dest='bandwidth', type="string", metavar="RATE",
+                      help='Bandwidth cap of the server in bytes/second (e.g. 50M)')
+    parser.add_option('', '--failure-rate', dest='failure_rate', type="float", default=0.0,
+                      help='Fraction of requests that fail with 503 (default: 0)')
+    parser.add_option('', '--retry-max-sleep', dest='retry_max_sleep', type="float",
+                      default=1.0, metavar="SECONDS",
+                      help='Maximum wait between retries (default: 1)')
+    parser.add_option('', '--seed', dest='seed', type="int", default=0,
+                      help='Seed of the injected failures (default: 0)')
+    parser.add_option('', '--playlist', dest='playlist', action='store_true',
+                      help='Add every video to a playlist')
+    parser.add_option('', '--thumbnail', dest='thumbnail', action='store_true',
+                      help='Set the thumbnail of every video')
+    options, args = parser.parse_args(arguments)
+    options.bandwidth = (throttle.parse_rate(options.bandwidth) if options.bandwidth else None)
+    lib.set_retry_policy(lib.RetryPolicy(base=0.1, max_sleep=options.retry_max_sleep))
+
+    fd, path = tempfile.mkstemp()
+    thumbnail_fd, thumbnail_path = tempfile.mkstemp(suffix=".jpg")
+    try:
+        block = os.urandom(1024 * 1024)
+        with os.fdopen(fd, "wb") as output:
+            for _ in range(options.size_mb):
+                output.write(block)
+        with os.fdopen(thumbnail_fd, "wb") as output:
+            output.write(THUMBNAIL)
+        print("{0:>9} {1:>8} {2:>8} {3:>8} {4:>6} {5:>7} {6:>8} {7:>8}".format(
+            "chunksize", "parallel", "seconds", "MB/s", "chunks", "retries", "failures",
+            "requests"))
+        for chunksize_mb in options.chunksizes_mb:
+            options.chunksize = chunksize_mb * 1024 * 1024
+            for parallel in options.parallel:
+                result = run(options, path, thumbnail_path, parallel)
+                print("{0:>8}M {1:>8} {seconds:>8.2f} {rate:>8.1f} {chunks:>6} {retries:>7} "
+                      "{failures:>8} {requests:>8}".format(chunksize_mb, parallel, **result))
+    finally:
+        os.remove(path)
+        os.remove(thumbnail_path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -30,8 +30,7 @@ setup_kwargs = {
     },
     "install_requires":[
         'google-api-python-client',
-        'oauth2client',
-        'progressbar2'
+        'oauth2client'
     ]
 }
 
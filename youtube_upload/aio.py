@@ -0,0 +1,381 @@
+"""
+Asyncio engine for uploads: the resumable upload protocol implemented on
+asyncio streams of the standard library (no httplib2), so a single event loop
+(one thread) drives many concurrent uploads. Requires Python >= 3.7.
+
+    video_ids = aio.upload_all(session, [dict(path=path, body=body), ...],
+                               concurrency=32)
+"""
+import ssl
+import json
+import time
+import socket
+import asyncio
+import http.client as httplib
+
+from urllib.parse import urlsplit, urlencode
+
+import googleapiclient.errors
+import httplib2
+
+from . import auth
+from . import lib
+from . import metrics
+from . import quota
+from .checksum import read_sidecar_checksum
+from .upload_video import MmapMediaUpload
+
+ROOT_URL = "https://www.googleapis.com/"
+
+UPLOAD_PATH = "upload/youtube/v3/videos"
+
+# Uploads run at the same time by upload_all
+DEFAULT_CONCURRENCY = 16
+
+# Chunks are written to the socket in blocks of this size (waiting for the bucket, if any)
+WRITE_SIZE = 256 * 1024
+
+# Seconds without progress (connect, write or read) before a request fails
+TIMEOUT = 60
+
+
+class Connection(object):
+    """HTTP/1.1 connection, kept alive between the requests to the same host."""
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.netloc = None
+        self.reader = None
+        self.writer = None
+
+    async def _wait(self, awaitable):
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout)
+        except asyncio.TimeoutError:
+            # socket.timeout is an EnvironmentError, retried by the RetryPolicy
+            raise socket.timeout("No progress in {0} seconds".format(self.timeout))
+
+    async def _connect(self, parts):
+        https = (parts.scheme == "https")
+        port = parts.port or (443 if https else 80)
+        self.reader, self.writer = await self._wait(asyncio.open_connection(
+            parts.hostname, port, ssl=(ssl.create_default_context() if https else None)))
+        self.netloc = parts.netloc
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.netloc = self.reader = self.writer = None
+
+    async def _read_line(self):
+        try:
+            line = await self._wait(self.reader.readuntil(b"\n"))
+        except asyncio.IncompleteReadError as exc:
+            if not exc.partial:
+                raise httplib.RemoteDisconnected("Connection closed without response")
+            raise httplib.IncompleteRead(exc.partial)
+        return line.decode("latin-1").rstrip("\r\n")
+
+    async def _read_exactly(self, size):
+        try:
+            return await self._wait(self.reader.readexactly(size))
+        except asyncio.IncompleteReadError as exc:
+            raise httplib.IncompleteRead(exc.partial, size - len(exc.partial))
+
+    async def _read_chunked(self):
+        chunks = []
+        while 1:
+            size = int((await self._read_line()).split(";")[0], 16)
+            if not size:
+                break
+            chunks.append(await self._read_exactly(size))
+            await self._read_line()
+        # Trailer headers, up to the empty line
+        while await self._read_line():
+            pass
+        return b"".join(chunks)
+
+    async def _read_response(self):
+        status_line = await self._read_line()
+        try:
+            version, status = status_line.split(" ", 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise httplib.BadStatusLine(status_line)
+        headers = {}
+        while 1:
+            line = await self._read_line()
+            if not line:
+                break
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked()
+        elif "content-length" in headers:
+            content = await self._read_exactly(int(headers["content-length"]))
+        else:
+            content = await self._wait(self.reader.read())
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+            self.close()
+        return status, headers, content
+
+    async def _send(self, method, parts, headers, body, bucket):
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        lines = ["{0} {1} HTTP/1.1".format(method, path), "Host: " + parts.netloc,
+                 "Content-Length: {0}".format(len(body))]
+        lines.extend("{0}: {1}".format(key, value) for (key, value) in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        view = memoryview(body)
+        for offset in range(0, len(view), WRITE_SIZE):
+            block = view[offset:offset + WRITE_SIZE]
+            wait = (bucket.reserve(len(block)) if bucket else 0)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.writer.write(block)
+            await self._wait(self.writer.drain())
+        await self._wait(self.writer.drain())
+
+    async def request(self, method, url, headers=None, body=b"", bucket=None):
+        """
+        Send a request to url and return (status, headers, content). If
+        bucket (throttle.TokenBucket) is given, the body is sent at its rate.
+        """
+        parts = urlsplit(url)
+        if parts.netloc != self.netloc:
+            self.close()
+        # A kept-alive connection may have been closed by the server, try once more
+        reused = self.writer is not None
+        while 1:
+            if not self.writer:
+                await self._connect(parts)
+            try:
+                await self._send(method, parts, headers or {}, body, bucket)
+                return await self._read_response()
+            except (httplib.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if not reused:
+                    raise
+                reused = False
+            except BaseException:
+                # Responses of failed requests would be read by the next ones
+                self.close()
+                raise
+
+
+def get_http_error(uri, status, headers, content):
+    """Return a googleapiclient HttpError of a response (handled as the ones of httplib2)."""
+    response = httplib2.Response(dict(headers, status=str(status)))
+    return googleapiclient.errors.HttpError(response, content, uri=uri)
+
+
+def get_range_end(headers):
+    """Return the offset after the last byte of the Range header (0 if missing)."""
+    value = headers.get("range")
+    return (int(value.split("-")[-1]) + 1 if value else 0)
+
+
+class ResumableUpload(object):
+    """State of a resumable upload: session URI, confirmed offset and chunk size."""
+
+    def __init__(self, media, uri=None, chunksize=None):
+        self.media = media
+        self.uri = uri
+        self.chunksize = chunksize or media.chunksize()
+        # None when unknown (after errors and when resuming): asked to the server
+        self.offset = (0 if uri is None else None)
+
+
+class AsyncUploader(object):
+    """
+    Upload videos on the running event loop. Requests are authorized with the
+    credentials of session (auth.Session), refreshed in a thread of the
+    executor when they are about to expire. Without session, requests are
+    not authorized (i.e. local test servers).
+    """
+
+    def __init__(self, session=None, root_url=ROOT_URL, timeout=TIMEOUT, policy=None):
+        self.session = session
+        self.root_url = root_url
+        self.timeout = timeout
+        self.policy = policy
+
+    async def _get_headers(self, force_refresh=False):
+        if not self.session:
+            return {}
+        credentials = self.session.credentials
+        if force_refresh or auth.expires_soon(credentials, self.session.refresh_margin):
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.session.refresh, force_refresh)
+        return {"Authorization": "Bearer " + credentials.access_token}
+
+    async def _request(self, connection, method, url, headers, body=b"", bucket=None):
+        """Send an authorized request, refreshing the access token once on 401."""
+        force_refresh = False
+        while 1:
+            request_headers = dict(headers, **(await self._get_headers(force_refresh)))
+            status, response_headers, content = \
+                await connection.request(method, url, request_headers, body, bucket)
+            if status != 401 or force_refresh or not self.session:
+                return status, response_headers, content
+            force_refresh = True
+
+    async def _retry(self, function, max_retries):
+        """Await function() retrying transient errors (as lib.retriable_exceptions)."""
+        retriable_exceptions = tuple(lib.get_retriable_exceptions())
+        start_time = time.time()
+        retry = 0
+        seconds = None
+        while 1:
+            try:
+                return await function()
+            except retriable_exceptions as exc:
+                retry += 1
+                seconds = lib.get_retry_wait(exc, retry, seconds, start_time, max_retries,
+                                             self.policy)
+                if seconds is None:
+                    raise
+                await asyncio.sleep(seconds)
+
+    async def _start(self, connection, body, media):
+        """Start an upload session and return its URI."""
+        query = urlencode(dict(uploadType="resumable", part=",".join(body.keys()), alt="json"))
+        url = "{0}{1}?{2}".format(self.root_url, UPLOAD_PATH, query)
+        headers = {
+            "Content-Type": "application/json; charset=UTF-8",
+            "X-Upload-Content-Length": str(media.size()),
+            "X-Upload-Content-Type": media.mimetype(),
+        }
+        status, response_headers, content = await self._request(
+            connection, "POST", url, headers, json.dumps(body).encode("utf-8"))
+        if status != 200 or "location" not in response_headers:
+            raise get_http_error(url, status, response_headers, content)
+        return response_headers["location"]
+
+    async def _send_chunk(self, connection, upload, bucket):
+        """Send the next chunk (or ask the offset). Return the response."""
+        media = upload.media
+        size = media.size()
+        if upload.offset is None:
+            data = b""
+            content_range = "bytes */{0}".format(size)
+        elif not size:
+            data = b""
+            content_range = "bytes */0"
+        else:
+            length = min(upload.chunksize, size - upload.offset)
+            loop = asyncio.get_running_loop()
+            # Read (page faults) and verify the checksum out of the event loop
+            data = await loop.run_in_executor(
+                None, lambda: bytes(media.getbytes(upload.offset, length)))
+            content_range = "bytes {0}-{1}/{2}".format(
+                upload.offset, upload.offset + length - 1, size)
+        headers = {"Content-Range": content_range, "Content-Type": media.mimetype()}
+        return await self._request(connection, "PUT", upload.uri, headers, data, bucket)
+
+    async def _send_chunks(self, connection, upload, progress_callback, chunk_callback,
+                           adaptive_chunksize, bucket):
+        """Send the chunks of upload from the confirmed offset. Return the video ID."""
+        while 1:
+            progress = upload.offset
+            start_time = time.time()
+            try:
+                status, headers, content = await self._send_chunk(connection, upload, bucket)
+            except Exception:
+                upload.offset = None
+                if adaptive_chunksize:
+                    upload.chunksize = adaptive_chunksize.get_after_error(upload.chunksize)
+                raise
+            elapsed = time.time() - start_time
+            if status in (200, 201):
+                sent_bytes = (upload.media.size() - progress if progress is not None else 0)
+                if chunk_callback:
+                    chunk_callback(upload, sent_bytes, elapsed)
+                video = json.loads(content.decode("utf-8"))
+                if "id" not in video:
+                    raise KeyError("Expected field 'id' not found in response")
+                return video["id"]
+            elif status != 308:
+                upload.offset = None
+                raise get_http_error(upload.uri, status, headers, content)
+            upload.offset = get_range_end(headers)
+            if progress is None:
+                lib.debug("Resuming upload session ({0} bytes sent)".format(upload.offset))
+                continue
+            sent_bytes = upload.offset - progress
+            if adaptive_chunksize:
+                upload.chunksize = adaptive_chunksize.get_next(upload.chunksize, sent_bytes,
+                                                               elapsed)
+            if progress_callback:
+                progress_callback(upload.media.size(), upload.offset)
+            if chunk_callback:
+                chunk_callback(upload, sent_bytes, elapsed)
+
+    async def upload(self, path, body, chunksize=4 * 1024 * 1024, progress_callback=None,
+                     max_retries=10, journal=None, resume=False, adaptive_chunksize=None,
+                     bucket=None):
+        """
+        Upload a video to Youtube. Return video ID. The arguments are the ones
+        of upload_video.upload (files only, not streams).
+        """
+        if adaptive_chunksize:
+            chunksize = adaptive_chunksize.get_initial(chunksize)
+        media = MmapMediaUpload(path, chunksize, checksum=read_sidecar_checksum(path))
+        connection = Connection(self.timeout)
+        journal_key = (journal.get_key(path) if journal else None)
+        session = (journal.get(journal_key) if journal and resume else None)
+
+        def chunk_callback(upload, sent_bytes, elapsed):
+            metrics.record("chunk", path=path, bytes=sent_bytes, seconds=elapsed)
+            if journal and upload.offset is not None:
+                journal.update(journal_key, upload.uri, upload.offset)
+
+        async def send(upload):
+            if upload.uri is None:
+                upload.uri = await self._start(connection, body, media)
+            return await self._send_chunks(connection, upload, progress_callback,
+                                           chunk_callback, adaptive_chunksize, bucket)
+
+        start_time = time.time()
+        upload = ResumableUpload(media, (session["uri"] if session else None), chunksize)
+        # Charged once per session, not on every retry of its start
+        if not session:
+            quota.charge("videos.insert")
+        try:
+            try:
+                video_id = await self._retry(lambda: send(upload), max_retries)
+            except googleapiclient.errors.HttpError as exc:
+                if not session or exc.resp.status not in (404, 410):
+                    raise
+                lib.debug("Upload session has expired, starting a new one")
+                upload = ResumableUpload(media, None, upload.chunksize)
+                quota.charge("videos.insert")
+                video_id = await self._retry(lambda: send(upload), max_retries)
+        finally:
+            connection.close()
+            media.close()
+        if journal:
+            journal.remove(journal_key)
+        metrics.record("upload", path=path, video_id=video_id, bytes=media.size(),
+                       seconds=time.time() - start_time)
+        return video_id
+
+    async def upload_all(self, uploads, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Run uploads (list of dictionaries with the keyword arguments of upload),
+        at most concurrency at the same time. Return their video IDs (or the
+        exceptions of the failed ones), in the same order.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(kwargs):
+            async with semaphore:
+                return await self.upload(**kwargs)
+        return await asyncio.gather(*[run(kwargs) for kwargs in uploads],
+                                    return_exceptions=True)
+
+
+def upload_all(session, uploads, concurrency=DEFAULT_CONCURRENCY, root_url=ROOT_URL):
+    """Run uploads (see AsyncUploader.upload_all) in a new event loop and return the results."""
+    uploader = AsyncUploader(session, root_url)
+    return asyncio.run(uploader.upload_all(uploads, concurrency))
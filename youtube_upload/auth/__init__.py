@@ -1,16 +1,63 @@
 """Wrapper for Google OAuth2 API."""
+import os
+import datetime
+import threading
 
+import googleapiclient
 import googleapiclient.discovery
 import httplib2
 import oauth2client
 
-from youtube_upload.auth import browser
-from youtube_upload.auth import console
 from oauth2client import client
 from oauth2client import file
 
+from youtube_upload import lib
+
 YOUTUBE_UPLOAD_SCOPE = ["https://www.googleapis.com/auth/youtube.upload", "https://www.googleapis.com/auth/youtube"]
 
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
+
+# Refresh the cached discovery document after a week
+DISCOVERY_CACHE_TTL = 7 * 24 * 3600
+
+# Seconds to wait for the discovery document (the bundled one is used otherwise)
+DISCOVERY_TIMEOUT = 10
+
+# Refresh access tokens that expire in less than this (seconds) before a request
+TOKEN_REFRESH_MARGIN = 300
+
+_discovery_lock = threading.Lock()
+_discovery_document = None
+
+
+class LockedStorage(oauth2client.file.Storage):
+    """
+    Credentials file that is locked between processes (not only threads) and
+    written atomically, so concurrent processes share refreshed tokens.
+    """
+
+    def __init__(self, filename):
+        oauth2client.file.Storage.__init__(self, filename)
+        self._file_lock = lib.FileLock(filename + ".lock")
+
+    def acquire_lock(self):
+        oauth2client.file.Storage.acquire_lock(self)
+        self._file_lock.acquire()
+
+    def release_lock(self):
+        self._file_lock.release()
+        oauth2client.file.Storage.release_lock(self)
+
+    def locked_put(self, credentials):
+        temp_path = "{0}.{1}.tmp".format(self._filename, os.getpid())
+        old_umask = os.umask(0o177)
+        try:
+            with open(temp_path, "w") as fd:
+                fd.write(credentials.to_json())
+        finally:
+            os.umask(old_umask)
+        getattr(os, "replace", os.rename)(temp_path, self._filename)
+
 
 def _get_credentials_interactively(flow, storage, get_code_callback):
     """Return the credentials asking the user."""
@@ -33,14 +80,143 @@ def _get_credentials(flow, storage, get_code_callback):
         return _get_credentials_interactively(flow, storage, get_code_callback)
 
 
-def get_resource(client_secrets_file, credentials_file, get_code_callback):
-    """Authenticate and return a googleapiclient.discovery.Resource object."""
+def get_credentials(client_secrets_file, credentials_file, get_code_callback):
+    """Return the user credentials (run the interactive flow if required)."""
     get_flow = oauth2client.client.flow_from_clientsecrets
     flow = get_flow(client_secrets_file, scope=YOUTUBE_UPLOAD_SCOPE)
-    storage = oauth2client.file.Storage(credentials_file)
-    credentials = _get_credentials(flow, storage, get_code_callback)
+    storage = LockedStorage(credentials_file)
+    return _get_credentials(flow, storage, get_code_callback)
+
+
+def get_http(credentials):
+    """Return a new httplib2.Http object authorized with credentials."""
+    httplib = httplib2.Http()
+    httplib.redirect_codes = httplib.redirect_codes - {308}
+    return credentials.authorize(httplib)
+
+
+def _get_library_version():
+    try:
+        # googleapiclient >= 2.0
+        from googleapiclient.version import __version__
+        return __version__
+    except ImportError:
+        return getattr(googleapiclient, "__version__", "unknown")
+
+
+def _get_discovery_cache_path():
+    # Documents are versioned by the library version that parses them
+    return lib.get_cache_path("youtube-v3-discovery-{0}.json".format(_get_library_version()))
+
+
+def _fetch_discovery_document(path):
+    resp, content = httplib2.Http(timeout=DISCOVERY_TIMEOUT).request(DISCOVERY_URL)
+    if resp.status != 200:
+        raise httplib2.HttpLib2Error("Cannot get discovery document: {0}".format(resp.status))
+    temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as fd:
+        fd.write(content)
+    getattr(os, "replace", os.rename)(temp_path, path)
+    return content
+
+
+def _get_fallback_discovery_document(path, exc):
+    if os.path.exists(path):
+        lib.debug("Using stale discovery document ({0})".format(exc))
+        with open(path, "rb") as fd:
+            return fd.read()
+    try:
+        # Document shipped with google-api-python-client >= 2.0
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        raise exc
+    lib.debug("Using discovery document of googleapiclient ({0})".format(exc))
+    return get_static_doc("youtube", "v3")
+
+
+def get_discovery_document():
+    """
+    Return the Youtube API discovery document. The document is cached on disk
+    and refreshed after DISCOVERY_CACHE_TTL seconds; if it cannot be fetched,
+    a stale cached copy (or the one shipped with googleapiclient) is used.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            path = _get_discovery_cache_path()
+            if lib.is_fresh(path, DISCOVERY_CACHE_TTL):
+                with open(path, "rb") as fd:
+                    _discovery_document = fd.read()
+            else:
+                try:
+                    _discovery_document = _fetch_discovery_document(path)
+                except (IOError, httplib2.HttpLib2Error) as exc:
+                    _discovery_document = _get_fallback_discovery_document(path, exc)
+        return _discovery_document
+
+
+def build_resource(http):
+    """Return a googleapiclient.discovery.Resource object using http."""
+    return googleapiclient.discovery.build_from_document(get_discovery_document(), http=http)
+
+
+def expires_soon(credentials, margin):
+    """Return True if the access token is missing or expires in less than margin seconds."""
+    if not credentials.access_token:
+        return True
+    elif credentials.token_expiry:
+        remaining = credentials.token_expiry - datetime.datetime.utcnow()
+        return remaining < datetime.timedelta(seconds=margin)
+    else:
+        return False
+
+
+class Session(object):
+    """
+    Authorized HTTP objects and API resources that share the credentials.
+
+    Each thread gets its own HTTP object (httplib2 is not thread-safe), reused
+    by all its resources so connections are kept alive between requests. The
+    access token is refreshed before a request when it is about to expire,
+    instead of when a request (i.e. an upload chunk) fails with a 401.
+    """
+
+    def __init__(self, credentials, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.refresh_http = httplib2.Http()
+        self.local = threading.local()
+
+    def refresh(self, force=False):
+        """Refresh the access token if it expires soon (or always, with force)."""
+        with self.lock:
+            if force or expires_soon(self.credentials, self.refresh_margin):
+                lib.debug("Refreshing access token")
+                # Uses a token refreshed by other process if found in the storage
+                self.credentials.refresh(self.refresh_http)
+
+    def get_http(self):
+        """Return the authorized HTTP object of the current thread."""
+        if not hasattr(self.local, "http"):
+            http = get_http(self.credentials)
+            authorized_request = http.request
+
+            def request(*args, **kwargs):
+                self.refresh()
+                return authorized_request(*args, **kwargs)
+            request.credentials = self.credentials
+            http.request = request
+            self.local.http = http
+        return self.local.http
+
+    def get_resource(self):
+        """Return a new API resource that uses the HTTP object of the current thread."""
+        return build_resource(self.get_http())
+
+
+def get_resource(client_secrets_file, credentials_file, get_code_callback):
+    """Authenticate and return a googleapiclient.discovery.Resource object."""
+    credentials = get_credentials(client_secrets_file, credentials_file, get_code_callback)
     if credentials:
-        httplib = httplib2.Http()
-        httplib.redirect_codes = httplib.redirect_codes - {308}
-        http = credentials.authorize(httplib)
-        return googleapiclient.discovery.build("youtube", "v3", http=http)
+        return Session(credentials).get_resource()
@@ -0,0 +1,71 @@
+"""Send API requests in batches (only for methods without media uploads)."""
+import threading
+
+from .lib import debug, get_call_name
+from . import metrics
+from . import quota
+
+# Maximum number of calls per batch recommended by the API
+BATCH_SIZE = 50
+
+
+class BatchError(Exception):
+    pass
+
+
+def check_results(results):
+    """
+    Report the failed requests of results (key, response, exception), as
+    returned by BatchCollector.execute, and raise BatchError if any failed.
+    """
+    errors = [(key, exc) for (key, response, exc) in results if exc]
+    for key, exc in errors:
+        debug("[{0}] Batch request failed: {1}".format(key, exc))
+    if errors:
+        raise BatchError("{0} of {1} batch requests failed".format(len(errors), len(results)))
+
+
+class BatchCollector(object):
+    """Collect API requests (tagged with a key) to execute them later in batches."""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, key, get_request, *args, **kwargs):
+        """
+        Add a request identified by key. The request is built on execution
+        with get_request(youtube, *args, **kwargs).
+        """
+        with self.lock:
+            self.requests.append((key, lambda youtube: get_request(youtube, *args, **kwargs)))
+
+    def execute(self, youtube):
+        """
+        Execute the collected requests. Return a list of (key, response, exception)
+        tuples in the same order the requests were added.
+        """
+        with self.lock:
+            requests, self.requests = self.requests, []
+        results = [None] * len(requests)
+
+        def _callback(request_id, response, exception):
+            index = int(request_id)
+            results[index] = (requests[index][0], response, exception)
+
+        indexed_requests = list(enumerate(requests))
+        for start in range(0, len(requests), self.batch_size):
+            batch_requests = indexed_requests[start:start + self.batch_size]
+            debug("Sending batch of {0} requests".format(len(batch_requests)))
+            batch = youtube.new_batch_http_request(callback=_callback)
+            for index, (key, get_request) in batch_requests:
+                request = get_request(youtube)
+                quota.charge(get_call_name(request))
+                batch.add(request, request_id=str(index))
+            with metrics.timed("api_call", call="batch"):
+                batch.execute()
+        return results
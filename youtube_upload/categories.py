@@ -1,9 +1,3 @@
-try:
-    #import urllib2 
-    from urllib2 import urlopen    
-    import urllib
-except ImportError:
-    from urllib.request import urlopen
 import json
 
 URL = "https://www.googleapis.com/youtube/v3/videoCategories"
@@ -43,6 +37,12 @@ IDS = {
 }
 
 def get(region_code="us", api_key=None):
+    try:
+        #import urllib2 
+        from urllib2 import urlopen    
+        import urllib
+    except ImportError:
+        from urllib.request import urlopen
     params = dict(part="snippet", regionCode=region_code, key=api_key)  
     full_url = URL + "?" + urllib.urlencode(params)
     response = urlopen(full_url)
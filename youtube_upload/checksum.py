@@ -0,0 +1,95 @@
+"""
+Verify the checksum of a video while it is uploaded: chunks are hashed in a
+background thread as they are sent, and the result is compared with the one
+in a sidecar checksum file (VIDEO.md5, VIDEO.sha1 or VIDEO.sha256, as written
+by md5sum/sha1sum/sha256sum) before the last chunk is sent.
+"""
+import os
+import hashlib
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+ALGORITHMS = ["md5", "sha1", "sha256"]
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def read_sidecar_checksum(path):
+    """Return (algorithm, hexdigest) from the sidecar checksum file of path, or None."""
+    for algorithm in ALGORITHMS:
+        sidecar_path = "{0}.{1}".format(path, algorithm)
+        if os.path.isfile(sidecar_path):
+            with open(sidecar_path) as fd:
+                fields = fd.read().split()
+            if not fields:
+                raise ChecksumError("Empty checksum file: {0}".format(sidecar_path))
+            return algorithm, fields[0].lower()
+    return None
+
+
+class BackgroundHasher(object):
+    """
+    Hash the data of a file in a background thread. Data is fed by offset
+    (i.e. the chunks of an upload, so the file is read once); data already
+    hashed (chunks sent again) is skipped, and gaps (i.e. the part sent by a
+    resumed upload) are read with get_data(begin, length).
+    """
+
+    def __init__(self, algorithm, get_data):
+        self.hasher = hashlib.new(algorithm)
+        self.get_data = get_data
+        self.offset = 0
+        self.error = None
+        self.condition = threading.Condition()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _update(self, offset, data):
+        if offset > self.offset:
+            self.hasher.update(self.get_data(self.offset, offset - self.offset))
+        else:
+            data = data[self.offset - offset:]
+        self.hasher.update(data)
+
+    def _run(self):
+        while 1:
+            item = self.queue.get()
+            if item is None:
+                break
+            offset, data = item
+            end = offset + len(data)
+            if end > self.offset:
+                try:
+                    self._update(offset, data)
+                except Exception as exc:
+                    with self.condition:
+                        self.error = exc
+                        self.condition.notify_all()
+                    break
+                with self.condition:
+                    self.offset = end
+                    self.condition.notify_all()
+
+    def feed(self, offset, data):
+        """Hash data (at offset of the file) in the background."""
+        self.queue.put((offset, data))
+
+    def get_hexdigest(self, size):
+        """Wait until size bytes are hashed and return the digest."""
+        with self.condition:
+            while self.offset < size and not self.error:
+                self.condition.wait()
+        if self.error:
+            raise ChecksumError("Cannot compute checksum: {0}".format(self.error))
+        return self.hasher.hexdigest()
+
+    def close(self):
+        self.queue.put(None)
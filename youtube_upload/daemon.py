@@ -0,0 +1,248 @@
+"""
+Watch a directory for new videos (daemon mode): detect the files that stopped
+changing and keep a durable queue (SQLite) of their upload jobs.
+"""
+import os
+import json
+import time
+import select
+import sqlite3
+import threading
+
+from . import lib
+from . import manifest
+
+# Seconds a file must stay unchanged (size and modification time) to be uploaded
+STABLE_TIME = 10
+
+# Seconds between scans of the directory when no changes are notified
+POLL_INTERVAL = 30
+
+# Extensions of the video files uploaded (other files, i.e. metadata or files
+# still being written by other programs, are ignored)
+VIDEO_EXTENSIONS = (".3g2", ".3gp", ".3gpp", ".avi", ".flv", ".m2ts", ".m4v", ".mkv", ".mov",
+                    ".mp4", ".mpeg", ".mpeg4", ".mpg", ".mts", ".mxf", ".ogv", ".ts", ".vob",
+                    ".webm", ".wmv")
+
+# Failed jobs are queued again until this number of attempts
+MAX_ATTEMPTS = 3
+
+# Seconds before the first retry of a failed job (doubled on every attempt)
+RETRY_DELAY = 60
+
+# inotify events (see inotify(7))
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+
+class InotifyWatcher(object):
+    """Wait for changes in a directory with inotify (Linux), using ctypes."""
+
+    def __init__(self, directory):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.path.abspath(directory).encode("utf-8"), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        """Wait until the directory changes or timeout seconds pass."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            # Events are not parsed, the directory is scanned afterwards
+            os.read(self.fd, 64 * 1024)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Wait for changes in a directory by polling (sleeps the timeout)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+def get_watcher(directory):
+    """Return a watcher of directory: inotify where available, polling otherwise."""
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError, TypeError) as exc:
+        lib.debug("Polling directory, inotify is not available ({0})".format(exc))
+        return PollingWatcher(directory)
+
+
+def is_video_filename(filename):
+    return not filename.startswith(".") and filename.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def get_signature(path):
+    """Return the signature of a video file that changes when it (or its sidecar) changes."""
+    stat = os.stat(path)
+    sidecar_path = manifest.get_sidecar_path(path)
+    sidecar_mtime = (os.path.getmtime(sidecar_path) if os.path.exists(sidecar_path) else None)
+    return (stat.st_size, stat.st_mtime, sidecar_mtime)
+
+
+class StableFiles(object):
+    """
+    Track the video files of a directory until they (and their sidecar files)
+    stay unchanged for stable_time seconds.
+    """
+
+    def __init__(self, directory, stable_time=STABLE_TIME):
+        self.directory = directory
+        self.stable_time = stable_time
+        # path -> (signature, time when the signature was first seen, reported)
+        self.files = {}
+
+    def scan(self):
+        """
+        Return (paths, pending): the files that became stable since the last
+        scan, and if there are files still changing.
+        """
+        now = time.time()
+        files = {}
+        stable_paths = []
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if not is_video_filename(filename) or not os.path.isfile(path):
+                continue
+            try:
+                signature = get_signature(path)
+            except OSError:
+                continue
+            previous_signature, since, reported = self.files.get(path, (signature, now, False))
+            if signature != previous_signature:
+                since, reported = now, False
+            if not reported and now - since >= self.stable_time:
+                stable_paths.append(path)
+                reported = True
+            files[path] = (signature, since, reported)
+        self.files = files
+        pending = any(not reported for (_, _, reported) in files.values())
+        return stable_paths, pending
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    video_id TEXT,
+    error TEXT,
+    created REAL,
+    updated REAL,
+    retry_at REAL,
+    UNIQUE (path, fingerprint)
+)
+"""
+
+
+class JobQueue(object):
+    """
+    Durable queue of upload jobs (SQLite). A job is unique by the path and
+    the fingerprint of the file, so a file is queued once; it moves through
+    the states: queued -> running -> done (or failed after MAX_ATTEMPTS).
+    A failed job is retried after RETRY_DELAY seconds, doubled on every attempt.
+    """
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path or lib.get_cache_path("queue.sqlite"),
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+            if "retry_at" not in columns:
+                # Queue of a previous version
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN retry_at REAL")
+
+    def _execute(self, sql, *args):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, args).fetchall()
+
+    def add(self, path, fingerprint, metadata):
+        """
+        Add a job (or queue again a failed job of the same file if its metadata
+        changed, for one more attempt). Return False if the file was already queued.
+        """
+        metadata_json = json.dumps(metadata, sort_keys=True)
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (path, fingerprint, metadata, state, created, "
+                "updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (path, fingerprint, metadata_json, time.time(), time.time()))
+            if not cursor.rowcount:
+                # The attempts are kept, so a file seen again (i.e. when the daemon
+                # is restarted) is not retried forever
+                cursor = self.connection.execute(
+                    "UPDATE jobs SET state = 'queued', attempts = MIN(attempts, ?), "
+                    "metadata = ?, retry_at = NULL, updated = ? "
+                    "WHERE path = ? AND fingerprint = ? AND state = 'failed' AND metadata != ?",
+                    (MAX_ATTEMPTS - 1, metadata_json, time.time(), path, fingerprint,
+                     metadata_json))
+            return cursor.rowcount > 0
+
+    def recover(self):
+        """Queue again the jobs left running (by a stopped daemon). Return their number."""
+        with self.lock, self.connection:
+            return self.connection.execute(
+                "UPDATE jobs SET state = 'queued', updated = ? WHERE state = 'running'",
+                (time.time(),)).rowcount
+
+    def start_next(self):
+        """
+        Mark the oldest queued job (not waiting to be retried) as running and
+        return (id, path, metadata), or None.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT id, path, metadata FROM jobs WHERE state = 'queued' AND "
+                "(retry_at IS NULL OR retry_at <= ?) ORDER BY id LIMIT 1",
+                (time.time(),)).fetchone()
+            if not row:
+                return None
+            self.connection.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ? "
+                "WHERE id = ?", (time.time(), row[0]))
+        return row[0], row[1], json.loads(row[2])
+
+    def finish(self, job_id, video_id):
+        """Mark a job as done."""
+        self._execute("UPDATE jobs SET state = 'done', video_id = ?, error = NULL, "
+                      "updated = ? WHERE id = ?", video_id, time.time(), job_id)
+
+    def fail(self, job_id, error):
+        """
+        Mark a job as failed, it is queued again (to be retried after a delay)
+        if it has attempts left.
+        """
+        now = time.time()
+        self._execute("UPDATE jobs SET state = (CASE WHEN attempts < ? THEN 'queued' "
+                      "ELSE 'failed' END), retry_at = ? + ? * (1 << (attempts - 1)), "
+                      "error = ?, updated = ? WHERE id = ?",
+                      MAX_ATTEMPTS, now, RETRY_DELAY, error, now, job_id)
+
+    def get_counts(self):
+        """Return a dictionary {state: number of jobs}."""
+        return dict(self._execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def close(self):
+        self.connection.close()
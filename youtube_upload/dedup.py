@@ -0,0 +1,52 @@
+"""Index of uploaded videos by content fingerprint, to skip already uploaded files."""
+import time
+import sqlite3
+import threading
+
+from . import lib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    account TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    path TEXT,
+    uploaded_at REAL,
+    PRIMARY KEY (account, fingerprint)
+)
+"""
+
+
+class UploadIndex(object):
+    """
+    SQLite index that maps the fingerprint (lib.fingerprint) of uploaded
+    files to their video ID, for an account (any string, i.e. a hash of the
+    credentials file).
+    """
+
+    def __init__(self, account, path=None):
+        self.account = account
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path or lib.get_cache_path("uploads.sqlite"),
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def get(self, fingerprint):
+        """Return the video ID of an uploaded file by fingerprint (None if not found)."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT video_id FROM uploads WHERE account = ? AND fingerprint = ?",
+                (self.account, fingerprint)).fetchone()
+        return (row[0] if row else None)
+
+    def add(self, fingerprint, size, video_id, path):
+        """Add an uploaded file to the index."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (self.account, fingerprint, size, video_id, path, time.time()))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,302 @@
+"""
+Local index (SQLite) of the inventory of a channel: its uploads, playlists
+and playlist items. The sync fetches only the pages of the listings that
+changed (If-None-Match with the etag of every page), and the uploads look up
+playlists and video titles in the index instead of listing them in the API.
+"""
+import time
+import sqlite3
+import threading
+
+from . import lib
+from . import playlists
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    account TEXT PRIMARY KEY,
+    uploads_playlist_id TEXT,
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    account TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title TEXT,
+    item_count INTEGER,
+    page INTEGER,
+    PRIMARY KEY (account, id)
+);
+CREATE TABLE IF NOT EXISTS playlist_items (
+    account TEXT NOT NULL,
+    id TEXT NOT NULL,
+    playlist_id TEXT NOT NULL,
+    video_id TEXT,
+    title TEXT,
+    position INTEGER,
+    page INTEGER,
+    PRIMARY KEY (account, id)
+);
+CREATE INDEX IF NOT EXISTS playlist_items_playlist ON playlist_items (account, playlist_id);
+CREATE TABLE IF NOT EXISTS pages (
+    account TEXT NOT NULL,
+    listing TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    page_token TEXT,
+    next_page_token TEXT,
+    etag TEXT,
+    PRIMARY KEY (account, listing, number)
+);
+"""
+
+# Listing of the playlists in the pages table (playlist items are listed by playlist ID)
+PLAYLISTS_LISTING = "playlists"
+
+PLAYLIST_FIELDS = "etag,nextPageToken,items(id,snippet(title),contentDetails(itemCount))"
+
+PLAYLIST_ITEM_FIELDS = ("etag,nextPageToken,"
+                        "items(id,snippet(title,position,resourceId(videoId)))")
+
+
+class InventoryError(Exception): pass
+
+
+def _is_not_modified(exc):
+    import googleapiclient.errors
+    return isinstance(exc, googleapiclient.errors.HttpError) and exc.resp.status == 304
+
+
+class Inventory(object):
+    """
+    Inventory of the channel of an account (any string, i.e. a hash of the
+    credentials file), with the page tokens and etags of the synced listings.
+    Videos and playlists created by the uploads are added, so the index is
+    up to date until the next sync.
+    """
+
+    def __init__(self, account, path=None):
+        self.account = account
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path or lib.get_cache_path("inventory.sqlite"),
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def _query(self, sql, *args):
+        with self.lock:
+            return self.connection.execute(sql, args).fetchall()
+
+    def _execute(self, sql, *args):
+        with self.lock, self.connection:
+            self.connection.execute(sql, args)
+
+    def is_synced(self):
+        """Return True if the channel has been synced."""
+        return bool(self._query("SELECT 1 FROM channels WHERE account = ? AND "
+                                "synced_at IS NOT NULL", self.account))
+
+    def get_uploads_playlist_id(self):
+        """Return the ID of the playlist of the uploads of the channel (None if not synced)."""
+        rows = self._query("SELECT uploads_playlist_id FROM channels WHERE account = ?",
+                           self.account)
+        return (rows[0][0] if rows else None)
+
+    def get_playlists(self):
+        """Return dictionary {title: id} with the playlists of the channel."""
+        playlist_ids = {}
+        for playlist_id, title in self._query(
+                "SELECT id, title FROM playlists WHERE account = ? ORDER BY page, rowid",
+                self.account):
+            playlist_ids.setdefault(title, playlist_id)
+        return playlist_ids
+
+    def get_playlist_ids(self):
+        """Return the IDs of the playlists of the channel."""
+        return [playlist_id for (playlist_id,) in self._query(
+            "SELECT id FROM playlists WHERE account = ? ORDER BY page, rowid", self.account)]
+
+    def add_playlist(self, playlist_id, title):
+        """Add a playlist created after the sync."""
+        self._execute("INSERT OR IGNORE INTO playlists (account, id, title, item_count) "
+                      "VALUES (?, ?, ?, 0)", self.account, playlist_id, title)
+
+    def get_videos_by_title(self, title):
+        """Return the IDs of the uploaded videos with title."""
+        return [video_id for (video_id,) in self._query(
+            "SELECT video_id FROM playlist_items WHERE account = ? AND playlist_id = ? "
+            "AND title = ?", self.account, self.get_uploads_playlist_id(), title)]
+
+    def add_video(self, video_id, title):
+        """Add a video uploaded after the sync."""
+        uploads_playlist_id = self.get_uploads_playlist_id()
+        if uploads_playlist_id:
+            self._execute("INSERT OR IGNORE INTO playlist_items (account, id, playlist_id, "
+                          "video_id, title) VALUES (?, ?, ?, ?, ?)", self.account,
+                          "local:" + video_id, uploads_playlist_id, video_id, title)
+
+    def get_playlist_items(self, playlist_id):
+        """Return the list of (video_id, title) of the items of a playlist, by position."""
+        return self._query("SELECT video_id, title FROM playlist_items WHERE account = ? "
+                           "AND playlist_id = ? ORDER BY position", self.account, playlist_id)
+
+    def get_counts(self):
+        """Return (videos, playlists, playlist items) in the inventory."""
+        uploads_playlist_id = self.get_uploads_playlist_id()
+        (videos, items), = self._query(
+            "SELECT COALESCE(SUM(playlist_id = ?), 0), COALESCE(SUM(playlist_id != ?), 0) "
+            "FROM playlist_items WHERE account = ?",
+            uploads_playlist_id, uploads_playlist_id, self.account)
+        return videos, len(self.get_playlists()), items
+
+    def _store_playlists(self, number, items):
+        self.connection.execute("DELETE FROM playlists WHERE account = ? AND page = ?",
+                                (self.account, number))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?)",
+            [(self.account, item["id"], item.get("snippet", {}).get("title"),
+              item.get("contentDetails", {}).get("itemCount"), number) for item in items])
+
+    def _store_playlist_items(self, playlist_id, number, items):
+        self.connection.execute("DELETE FROM playlist_items WHERE account = ? AND "
+                                "playlist_id = ? AND page = ?", (self.account, playlist_id, number))
+        rows = []
+        for item in items:
+            snippet = item.get("snippet", {})
+            rows.append((self.account, item["id"], playlist_id,
+                         snippet.get("resourceId", {}).get("videoId"), snippet.get("title"),
+                         snippet.get("position"), number))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO playlist_items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _sync_pages(self, listing, get_request, store_items):
+        """
+        Fetch the pages of a listing (get_request(page_token) returns the request
+        of a page) that changed since the last sync, and store their items with
+        store_items(page_number, items). Return (pages fetched, pages not modified).
+        """
+        number = 0
+        page_token = None
+        fetched = not_modified = 0
+        while 1:
+            rows = self._query("SELECT page_token, next_page_token, etag FROM pages "
+                               "WHERE account = ? AND listing = ? AND number = ?",
+                               self.account, listing, number)
+            page = (rows[0] if rows and rows[0][0] == page_token and rows[0][2] else None)
+            request = get_request(page_token)
+            if page:
+                request.headers["If-None-Match"] = page[2]
+            try:
+                response = lib.execute(request)
+            except Exception as exc:
+                if not page or not _is_not_modified(exc):
+                    raise
+                next_page_token = page[1]
+                not_modified += 1
+            else:
+                next_page_token = response.get("nextPageToken")
+                with self.lock, self.connection:
+                    store_items(number, response.get("items", []))
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.account, listing, number, page_token, next_page_token,
+                         response.get("etag")))
+                fetched += 1
+            number += 1
+            if not next_page_token:
+                break
+            page_token = next_page_token
+        # Remove the pages after the last one (the listing is shorter than in the last
+        # sync) and the entries added after the last sync (now in the pages fetched)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM pages WHERE account = ? AND listing = ? "
+                                    "AND number >= ?", (self.account, listing, number))
+            if listing == PLAYLISTS_LISTING:
+                self.connection.execute("DELETE FROM playlists WHERE account = ? AND "
+                                        "(page >= ? OR page IS NULL)", (self.account, number))
+            else:
+                self.connection.execute("DELETE FROM playlist_items WHERE account = ? AND "
+                                        "playlist_id = ? AND (page >= ? OR page IS NULL)",
+                                        (self.account, listing, number))
+        return fetched, not_modified
+
+    def sync_channel(self, youtube):
+        """Store the uploads playlist of the channel and return its ID."""
+        request = youtube.channels().list(mine=True, part="contentDetails",
+                                          fields="items(contentDetails(relatedPlaylists))")
+        items = lib.execute(request).get("items", [])
+        if not items:
+            raise InventoryError("The account has no channel")
+        uploads_playlist_id = items[0]["contentDetails"]["relatedPlaylists"]["uploads"]
+        self._execute("INSERT OR IGNORE INTO channels (account) VALUES (?)", self.account)
+        self._execute("UPDATE channels SET uploads_playlist_id = ? WHERE account = ?",
+                      uploads_playlist_id, self.account)
+        return uploads_playlist_id
+
+    def sync_playlists(self, youtube):
+        """
+        Sync the playlists of the channel (removing the items of the deleted
+        ones). Return (pages fetched, pages not modified).
+        """
+        def get_request(page_token):
+            return youtube.playlists().list(mine=True, part="id,snippet,contentDetails",
+                                            maxResults=50, pageToken=page_token,
+                                            fields=PLAYLIST_FIELDS)
+        result = self._sync_pages(PLAYLISTS_LISTING, get_request, self._store_playlists)
+        with self.lock, self.connection:
+            deleted = "NOT IN (SELECT id FROM playlists WHERE account = ?1) AND {0} != " \
+                "(SELECT uploads_playlist_id FROM channels WHERE account = ?1)"
+            self.connection.execute("DELETE FROM playlist_items WHERE account = ?1 AND "
+                                    "playlist_id " + deleted.format("playlist_id"),
+                                    (self.account,))
+            self.connection.execute("DELETE FROM pages WHERE account = ?1 AND listing != ?2 "
+                                    "AND listing " + deleted.format("listing"),
+                                    (self.account, PLAYLISTS_LISTING))
+        return result
+
+    def sync_playlist_items(self, youtube, playlist_id):
+        """Sync the items of a playlist. Return (pages fetched, pages not modified)."""
+        def get_request(page_token):
+            return youtube.playlistItems().list(playlistId=playlist_id, part="id,snippet",
+                                                maxResults=50, pageToken=page_token,
+                                                fields=PLAYLIST_ITEM_FIELDS)
+        store_items = lambda number, items: self._store_playlist_items(playlist_id, number,
+                                                                        items)
+        return self._sync_pages(playlist_id, get_request, store_items)
+
+    def set_synced(self):
+        """Record the end of a sync."""
+        self._execute("UPDATE channels SET synced_at = ? WHERE account = ?",
+                      time.time(), self.account)
+
+    def close(self):
+        self.connection.close()
+
+
+class InventoryPlaylistCache(playlists.PlaylistCache):
+    """
+    PlaylistCache that gets the playlists from the inventory instead of
+    listing them in the API (until it is invalidated by a stale entry).
+    """
+
+    def __init__(self, inventory):
+        playlists.PlaylistCache.__init__(self)
+        self.inventory = inventory
+        self.stale = False
+
+    def _load(self, youtube):
+        if self.stale:
+            return playlists.PlaylistCache._load(self, youtube)
+        self.playlist_ids, self.updated = self.inventory.get_playlists(), time.time()
+        return False
+
+    def _list(self, youtube):
+        playlists.PlaylistCache._list(self, youtube)
+        # Playlists created since the sync
+        for title, playlist_id in self.playlist_ids.items():
+            self.inventory.add_playlist(playlist_id, title)
+
+    def add(self, title, playlist_id):
+        playlists.PlaylistCache.add(self, title, playlist_id)
+        self.inventory.add_playlist(playlist_id, title)
+
+    def invalidate(self):
+        self.stale = True
+        playlists.PlaylistCache.invalidate(self)
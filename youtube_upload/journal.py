@@ -0,0 +1,70 @@
+"""Journal of resumable upload sessions, so interrupted uploads can be resumed."""
+import os
+import json
+import time
+import threading
+
+from . import lib
+
+# Youtube keeps resumable sessions for about a week
+SESSION_TTL = 6 * 24 * 3600
+
+_journal_lock = threading.Lock()
+
+
+class UploadJournal(object):
+    """
+    Store the session URI and the confirmed byte offset of resumable uploads,
+    keyed by the file path, size, modification time and content fingerprint.
+    The journal is shared (with a file lock) by all processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or lib.get_cache_path("sessions.json")
+        self.file_lock = lib.FileLock(self.path + ".lock")
+
+    @staticmethod
+    def get_key(path):
+        """Return the journal key of a video file."""
+        stat = os.stat(path)
+        return "{0}:{1}:{2}:{3}".format(os.path.abspath(path), stat.st_size,
+                                        int(stat.st_mtime), lib.fingerprint(path))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as fd:
+            try:
+                sessions = json.load(fd)
+            except ValueError:
+                lib.debug("Ignoring corrupt upload journal: {0}".format(self.path))
+                return {}
+        now = time.time()
+        return dict((key, session) for (key, session) in sessions.items()
+                    if now - session["updated"] < SESSION_TTL)
+
+    def _save(self, sessions):
+        temp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(temp_path, "w") as fd:
+            json.dump(sessions, fd)
+        # atomic replace (os.rename fails on Windows if the destination exists)
+        getattr(os, "replace", os.rename)(temp_path, self.path)
+
+    def get(self, key):
+        """Return the session (dict with keys uri/offset) for key (None if not found)."""
+        with _journal_lock, self.file_lock:
+            return self._load().get(key)
+
+    def update(self, key, uri, offset):
+        """Store the session URI and the confirmed offset for key."""
+        with _journal_lock, self.file_lock:
+            sessions = self._load()
+            sessions[key] = dict(uri=uri, offset=offset, updated=time.time())
+            self._save(sessions)
+
+    def remove(self, key):
+        """Remove the session for key."""
+        with _journal_lock, self.file_lock:
+            sessions = self._load()
+            if sessions.pop(key, None):
+                self._save(sessions)
@@ -1,13 +1,22 @@
 from __future__ import print_function
 import os
 import sys
+import json
+import errno
 import locale
 import random
+import hashlib
 import time
 import signal
+import threading
 from contextlib import contextmanager
 
-import googleapiclient.errors
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import metrics
 
 @contextmanager
 def default_sigint():
@@ -31,9 +40,19 @@ def to_utf8(s):
     else:
         return s
        
+_debug_handler = None
+
+def set_debug_handler(handler):
+    """Send the debug messages to handler(obj, fd) instead (None to restore)."""
+    global _debug_handler
+    _debug_handler = handler
+
 def debug(obj, fd=sys.stderr):
     """Write obj to standard error."""
-    print(obj, file=fd)
+    if _debug_handler:
+        _debug_handler(obj, fd)
+    else:
+        print(obj, file=fd)
 
 def catch_exceptions(exit_codes, fun, *args, **kwargs):
     """
@@ -64,31 +83,214 @@ def get_first_existing_filename(prefixes, relative_path):
         if os.path.exists(path):
             return path
 
-def retriable_exceptions(fun, retriable_exceptions, max_retries=None):
-    """Run function and retry on some exceptions (with exponential backoff)."""
+def get_cache_path(filename):
+    """Return the path of filename in the user cache directory (created if missing)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(cache_home, "youtube-upload")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, filename)
+
+def is_fresh(path, ttl):
+    """Return True if path exists and was modified less than ttl seconds ago."""
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl
+
+class FileLock(object):
+    """Exclusive lock of threads and processes (where fcntl is available) on a lock file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def acquire(self):
+        self.lock.acquire()
+        self.fd = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+        self.fd = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def fingerprint(path, block_size=64 * 1024, samples=16):
+    """Return a fast fingerprint of a file (hash of its size and some sampled blocks)."""
+    size = os.path.getsize(path)
+    hasher = hashlib.sha1(str(size).encode("ascii"))
+    with open(path, "rb") as fd:
+        if size <= block_size * samples:
+            hasher.update(fd.read())
+        else:
+            for index in range(samples):
+                fd.seek((size - block_size) * index // (samples - 1))
+                hasher.update(fd.read(block_size))
+    return hasher.hexdigest()
+
+# API errors that are transient (retriable) and errors of exhausted quota (not retriable)
+RATE_LIMIT_REASONS = ["rateLimitExceeded", "userRateLimitExceeded"]
+QUOTA_EXCEEDED_REASONS = ["quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded"]
+
+# Errors of local files, not worth retrying
+FATAL_ERRNOS = [errno.ENOENT, errno.EACCES, errno.EPERM, errno.EISDIR, errno.ENOTDIR,
+                errno.ENOSPC]
+
+def _get_httplib():
+    try:
+        import httplib
+    except ImportError:
+        import http.client as httplib
+    return httplib
+
+def get_retriable_exceptions():
+    """Return the exceptions (network and HTTP errors) that may be retried."""
+    import googleapiclient.errors
+    import httplib2
+    httplib = _get_httplib()
+    return [EnvironmentError, httplib.HTTPException, httplib2.HttpLib2Error,
+            googleapiclient.errors.HttpError]
+
+def get_error_reason(exc):
+    """Return the reason of an API error (i.e. "quotaExceeded"), None if unknown."""
+    try:
+        content = (exc.content.decode("utf-8") if isinstance(exc.content, bytes) else exc.content)
+        return json.loads(content)["error"]["errors"][0]["reason"]
+    except (AttributeError, TypeError, ValueError, KeyError, IndexError):
+        return None
+
+def get_retry_after(exc):
+    """Return the seconds to wait in the Retry-After header of an API error (or None)."""
+    import email.utils
+    value = (getattr(exc, "resp", None) or {}).get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        return (max(0.0, email.utils.mktime_tz(date) - time.time()) if date else None)
+
+class RetryPolicy(object):
+    """
+    Decide which errors are retried and how long to wait between retries:
+    decorrelated jitter (a random wait between base and 3 times the previous
+    one) limited to max_sleep, or the Retry-After sent by the server. No
+    retry is done if the total time would exceed deadline seconds.
+    """
+
+    def __init__(self, base=1.0, max_sleep=64.0, deadline=None):
+        self.base = base
+        self.max_sleep = max_sleep
+        self.deadline = deadline
+
+    def is_quota_exceeded(self, exc):
+        """Return True if exc is an API error of exhausted quota."""
+        return getattr(exc, "resp", None) is not None and \
+            get_error_reason(exc) in QUOTA_EXCEEDED_REASONS
+
+    def is_retriable(self, exc):
+        """Return True if the error exc is transient."""
+        import googleapiclient.errors
+        import httplib2
+        httplib = _get_httplib()
+        if isinstance(exc, googleapiclient.errors.HttpError):
+            status = exc.resp.status
+            return status >= 500 or status == 429 or \
+                (status == 403 and get_error_reason(exc) in RATE_LIMIT_REASONS)
+        elif isinstance(exc, EnvironmentError):
+            return getattr(exc, "errno", None) not in FATAL_ERRNOS
+        else:
+            return isinstance(exc, (httplib.HTTPException, httplib2.HttpLib2Error))
+
+    def get_wait(self, exc, previous_wait):
+        """Return the seconds to wait before retrying after the error exc."""
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            return retry_after
+        return min(self.max_sleep, random.uniform(self.base, max(self.base, previous_wait * 3)))
+
+_retry_policy = RetryPolicy()
+
+def set_retry_policy(policy):
+    """Set the RetryPolicy used when none is passed to retriable_exceptions."""
+    global _retry_policy
+    _retry_policy = policy
+
+def get_call_name(request):
+    """Return the name of the API call of a request (i.e. "playlists.list")."""
+    return (request.methodId or "").replace("youtube.", "", 1)
+
+def execute(request, max_retries=10):
+    """
+    Execute an API request (retrying transient errors), record its latency and
+    account its quota.
+    """
+    from . import quota
+    call = get_call_name(request)
+
+    def _execute():
+        quota.charge(call)
+        with metrics.timed("api_call", call=call):
+            return request.execute()
+    return retriable_exceptions(_execute, get_retriable_exceptions(), max_retries=max_retries)
+
+def get_retry_wait(exc, retry, previous_wait=None, start_time=None, max_retries=None,
+                   policy=None):
+    """
+    Return the seconds to wait before the retry number retry after the error
+    exc (previous_wait is the last wait), or None if exc must not be retried.
+    """
+    policy = policy or _retry_policy
+    if not policy.is_retriable(exc):
+        if policy.is_quota_exceeded(exc):
+            from . import quota
+            debug("[Quota exceeded] {0}".format(get_error_reason(exc)))
+            quota.exhaust()
+        return None
+    elif max_retries is not None and retry > max_retries:
+        debug("[Retryable errors] Retry limit reached")
+        return None
+    seconds = policy.get_wait(exc, policy.base if previous_wait is None else previous_wait)
+    if policy.deadline is not None and start_time is not None and \
+            time.time() - start_time + seconds > policy.deadline:
+        debug("[Retryable errors] Retry deadline reached")
+        return None
+    message = ("[Retryable error {current_retry}/{total_retries}] " +
+        "{error_type} ({error_msg}). Wait {wait_time} seconds").format(
+        current_retry=retry, 
+        total_retries=max_retries or "-", 
+        error_type=type(exc).__name__, 
+        error_msg=str(exc) or "-", 
+        wait_time="%.1f" % seconds,
+    )
+    debug(message)
+    metrics.record("retry", error=type(exc).__name__, wait=seconds)
+    return seconds
+
+def retriable_exceptions(fun, retriable_exceptions, max_retries=None, policy=None):
+    """
+    Run function and retry on some exceptions, if transient according to
+    the RetryPolicy policy (by default, the one set with set_retry_policy).
+    """
+    start_time = time.time()
     retry = 0
+    seconds = None
     while 1:
         try:
             return fun()
         except tuple(retriable_exceptions) as exc:
             retry += 1
-            if type(exc) not in retriable_exceptions:
-                raise exc
-            # we want to retry 5xx errors only
-            elif type(exc) == googleapiclient.errors.HttpError and exc.resp.status < 500:
-                raise exc
-            elif max_retries is not None and retry > max_retries:
-                debug("[Retryable errors] Retry limit reached")
-                raise exc
-            else:
-                seconds = random.uniform(0, 2**retry)
-                message = ("[Retryable error {current_retry}/{total_retries}] " +
-                    "{error_type} ({error_msg}). Wait {wait_time} seconds").format(
-                    current_retry=retry, 
-                    total_retries=max_retries or "-", 
-                    error_type=type(exc).__name__, 
-                    error_msg=str(exc) or "-", 
-                    wait_time="%.1f" % seconds,
-                )
-                debug(message)
-                time.sleep(seconds)
+            seconds = get_retry_wait(exc, retry, seconds, start_time, max_retries, policy)
+            if seconds is None:
+                raise
+            time.sleep(seconds)
@@ -17,27 +17,38 @@ Upload a video to Youtube from the command-line.
 
 import os
 import sys
+import json
+import shutil
+import hashlib
+import functools
 import optparse
+import tempfile
 import collections
 import webbrowser
 from io import open
+from contextlib import contextmanager
+from concurrent import futures
 
-import googleapiclient.errors
-import oauth2client
-
-from oauth2client import file
-
-from . import auth
-from . import upload_video
+# Modules that import googleapiclient/oauth2client (auth, upload_video) are
+# imported when needed, so the startup (and --help) is fast.
 from . import categories
 from . import lib
 from . import playlists
-
-# http://code.google.com/p/python-progressbar (>= 2.3)
-try:
-    import progressbar2
-except ImportError:
-    progressbar = None
+from . import manifest
+from . import metrics
+from . import throttle
+from . import split
+from . import quota
+from . import daemon
+from . import checksum
+from . import update
+from . import thumbnail
+from . import progress
+from .scheduler import UploadScheduler
+from .journal import UploadJournal
+from .dedup import UploadIndex
+from .batch import BatchCollector, BatchError, check_results
+from .inventory import Inventory, InventoryError, InventoryPlaylistCache
 
 
 class InvalidCategory(Exception): pass
@@ -57,8 +68,14 @@ EXIT_CODES = {
     InvalidCategory: 3,
     RequestError: 3,
     AuthenticationError: 4,
-    oauth2client.client.FlowExchangeError: 4,
     NotImplementedError: 5,
+    manifest.ManifestError: 2,
+    split.SplitError: 6,
+    quota.QuotaError: 7,
+    checksum.ChecksumError: 8,
+    InventoryError: 3,
+    thumbnail.ThumbnailError: 3,
+    BatchError: 3,
 }
 
 WATCH_VIDEO_URL = "https://www.youtube.com/watch?v={id}"
@@ -72,38 +89,6 @@ def open_link(url):
     webbrowser.open(url)
 
 
-def get_progress_info():
-    """Return a function callback to update the progressbar."""
-    progressinfo = struct("ProgressInfo", ["callback", "finish"])
-
-    if progressbar:
-        bar = progressbar.ProgressBar(widgets=[
-            progressbar.Percentage(),
-            ' ', progressbar.Bar(),
-            ' ', progressbar.FileTransferSpeed(),
-            ' ', progressbar.DataSize(), '/', progressbar.DataSize('max_value'),
-            ' ', progressbar.Timer(),
-            ' ', progressbar.AdaptiveETA(),
-        ])
-
-        def _callback(total_size, completed):
-            if not hasattr(bar, "next_update"):
-                if hasattr(bar, "maxval"):
-                    bar.maxval = total_size
-                else:
-                    bar.max_value = total_size
-                bar.start()
-            bar.update(completed)
-
-        def _finish():
-            if hasattr(bar, "next_update"):
-                return bar.finish()
-
-        return progressinfo(callback=_callback, finish=_finish)
-    else:
-        return progressinfo(callback=None, finish=lambda: True)
-
-
 def get_category_id(category):
     """Return category ID from its name."""
     if category:
@@ -116,24 +101,27 @@ def get_category_id(category):
             raise InvalidCategory(msg)
 
 
-def upload_youtube_video(youtube, options, video_path, total_videos, index):
-    """Upload video with index (for split videos)."""
+def get_video_title(options, total_videos=1, index=0):
+    """Return the title of a video (with the title template for multiple videos)."""
     u = lib.to_utf8
     title = u(options.title)
+    ns = dict(title=title, n=index + 1, total=total_videos)
+    title_template = u(options.title_template)
+    return (title_template.format(**ns) if total_videos > 1 else title)
+
+
+def get_request_body(options, total_videos=1, index=0):
+    """Return the body of the video resource from the options."""
+    u = lib.to_utf8
     if hasattr(u('string'), 'decode'):
         description = u(options.description or "").decode("string-escape")
     else:
         description = options.description
-    if options.publish_at:
-        debug("Your video will remain private until specified date.")
 
     tags = [u(s.strip()) for s in (options.tags or "").split(",")]
-    ns = dict(title=title, n=index + 1, total=total_videos)
-    title_template = u(options.title_template)
-    complete_title = (title_template.format(**ns) if total_videos > 1 else title)
-    progress = get_progress_info()
+    complete_title = get_video_title(options, total_videos, index)
     category_id = get_category_id(options.category)
-    request_body = {
+    return {
         "snippet": {
             "title": complete_title,
             "description": description,
@@ -156,68 +144,737 @@ def upload_youtube_video(youtube, options, video_path, total_videos, index):
         },
     }
 
+
+def upload_youtube_video(youtube, options, video_path, total_videos, index, bucket=None):
+    """
+    Upload video with index (for split videos). If bucket (throttle.TokenBucket)
+    is given, the upload rate is limited by it.
+    """
+    from . import upload_video
+    if options.publish_at:
+        debug("Your video will remain private until specified date.")
+    request_body = get_request_body(options, total_videos, index)
+
+    if options.adaptive_chunksize:
+        adaptive_chunksize = upload_video.AdaptiveChunkSize(
+            target_time=options.chunk_target_time,
+            min_size=options.min_chunksize, max_size=options.max_chunksize)
+    else:
+        adaptive_chunksize = None
+
     debug("Start upload: {0}".format(video_path))
+    total_size = (os.path.getsize(video_path) if video_path != "-" and not options.live
+                  else None)
+    upload_id = progress.start(video_path, total_size)
+    video_id = None
     try:
         video_id = upload_video.upload(youtube, video_path,
-                                       request_body, progress_callback=progress.callback,
-                                       chunksize=options.chunksize)
+                                       request_body,
+                                       progress_callback=progress.get_callback(upload_id),
+                                       chunksize=options.chunksize,
+                                       journal=UploadJournal(), resume=options.resume,
+                                       adaptive_chunksize=adaptive_chunksize,
+                                       bucket=bucket, live=options.live)
     finally:
-        progress.finish()
+        progress.finish(upload_id, video_id)
     return video_id
 
 
-def get_youtube_handler(options):
-    """Return the API Youtube object."""
+def get_credentials_file(options):
+    """Return the path of the credentials file."""
     home = os.path.expanduser("~")
     default_credentials = os.path.join(home, ".youtube-upload-credentials.json")
-    client_secrets = options.client_secrets or os.path.join(home, ".client_secrets.json")
-    credentials = options.credentials_file or default_credentials
+    return options.credentials_file or default_credentials
+
+
+def get_client_secrets_file(options):
+    """Return the path of the client secrets file."""
+    home = os.path.expanduser("~")
+    return options.client_secrets or os.path.join(home, ".client_secrets.json")
+
+
+def get_credentials(options):
+    """Return the user credentials for the API Youtube object."""
+    import oauth2client.client
+    from . import auth
+    from .auth import browser, console
+    client_secrets = get_client_secrets_file(options)
+    credentials = get_credentials_file(options)
     debug("Using client secrets: {0}".format(client_secrets))
     debug("Using credentials file: {0}".format(credentials))
-    get_code_callback = (auth.browser.get_code
-                         if options.auth_browser else auth.console.get_code)
-    return auth.get_resource(client_secrets, credentials,
-                             get_code_callback=get_code_callback)
+    get_code_callback = (browser.get_code if options.auth_browser else console.get_code)
+    try:
+        return auth.get_credentials(client_secrets, credentials,
+                                    get_code_callback=get_code_callback)
+    except oauth2client.client.FlowExchangeError as exc:
+        raise AuthenticationError(str(exc))
+
+
+def get_credentials_key(options):
+    """Return a short key that identifies the credentials file (so the account)."""
+    credentials_path = os.path.abspath(get_credentials_file(options))
+    return hashlib.sha1(credentials_path.encode("utf-8")).hexdigest()[:12]
+
+
+def get_quota_project(options):
+    """Return the project (of the client secrets) whose API quota is used."""
+    client_secrets = get_client_secrets_file(options)
+    try:
+        with open(client_secrets) as fd:
+            secrets = list(json.load(fd).values())[0]
+        return secrets.get("project_id") or secrets["client_id"]
+    except (IOError, ValueError, AttributeError, KeyError, IndexError):
+        return os.path.abspath(client_secrets)
+
+
+def get_playlist_cache(options):
+    """Return the playlists cache (persisted per credentials file if a TTL is set)."""
+    if options.playlist_cache_ttl:
+        key = get_credentials_key(options)
+        path = lib.get_cache_path("playlists-{0}.json".format(key))
+        return playlists.PlaylistCache(path, ttl=options.playlist_cache_ttl)
+    else:
+        return playlists.PlaylistCache()
+
+
+def set_thumbnail(youtube, video_id, thumbnail_path):
+    """Set the thumbnail of a video."""
+    return lib.execute(youtube.thumbnails().set(videoId=video_id, media_body=thumbnail_path))
+
+
+def add_videos_to_playlists(scheduler, playlist_videos, playlist_cache=None, batch=False,
+                            wait_quota=False):
+    """
+    Add videos to their playlists, in order. playlist_videos is a dictionary
+    {title: (privacy, [(video_path, video_id), ...])}; playlists are filled
+    concurrently (with wait_quota, once their quota is available). Return the
+    errors [(playlist title, exception)].
+    """
+    tasks = []
+    for title, (privacy, videos) in playlist_videos.items():
+        video_ids = [video_id for (video_path, video_id) in videos]
+        labels = dict((video_id, video_path) for (video_path, video_id) in videos)
+        add_videos = (functools.partial(run_with_quota, get_playlist_quota_cost(len(video_ids)),
+                                        playlists.add_videos_to_playlist)
+                      if wait_quota else playlists.add_videos_to_playlist)
+        tasks.append((title, scheduler.submit(add_videos, video_ids,
+                                              title=title, privacy=privacy,
+                                              cache=playlist_cache, batch=batch,
+                                              labels=labels)))
+    errors = []
+    for title, task in tasks:
+        try:
+            task.result()
+        except Exception as exc:
+            errors.append((title, exc))
+    return errors
+
+
+def execute_batch(youtube, batch):
+    """Execute the batched requests and report the failed ones."""
+    check_results(batch.execute(youtube))
+
+
+def get_upload_quota_cost(options):
+    """
+    Return the quota units of the API calls to upload a video (the follow-up
+    calls, run later and maybe in other threads, reserve their own units).
+    """
+    return quota.get_cost("videos.insert")
+
+
+def get_playlist_quota_cost(videos, ordered=True):
+    """
+    Return the quota units (worst case) to add a number of videos to a playlist
+    by title: list the playlists and create it if not found, insert the videos
+    and, if ordered (see playlists.add_videos_to_playlist), list the items of
+    the playlist and move the videos if their order must be fixed. The next
+    pages of the lists are charged as they are read.
+    """
+    calls = ["playlists.list", "playlists.insert"] + ["playlistItems.insert"] * videos
+    if ordered:
+        calls += ["playlistItems.list"] + ["playlistItems.update"] * videos
+    return sum(quota.get_cost(call) for call in calls)
+
+
+def run_with_quota(units, fun, *args, **kwargs):
+    """
+    Run fun(*args, **kwargs) once the units of quota are available in the budget
+    of today. If the API returns a quota error anyway, wait for the reset and retry.
+    """
+    import googleapiclient.errors
+    ledger = quota.get_ledger()
+    while 1:
+        with ledger.reserve(units):
+            try:
+                return fun(*args, **kwargs)
+            except googleapiclient.errors.HttpError as exc:
+                # The quota was accounted as used up on the error
+                if lib.get_error_reason(exc) not in lib.QUOTA_EXCEEDED_REASONS:
+                    raise
+
+
+def upload_youtube_video_with_quota(youtube, options, *args):
+    """Upload a video once the quota of the upload is available (see run_with_quota)."""
+    return run_with_quota(get_upload_quota_cost(options), upload_youtube_video,
+                          youtube, options, *args)
+
+
+def upload_video_job(youtube, scheduler, options, video_path, total_videos, index,
+                     playlist_cache=None, add_to_playlist=True, bucket=None, upload_index=None,
+                     inventory=None):
+    """
+    Upload a video and schedule its follow-up tasks. Return (video_id, tasks).
+    If not add_to_playlist, the caller adds the video to the playlist (i.e. with
+    add_videos_to_playlists, to keep the order of the videos).
+    If upload_index (UploadIndex) is given, record the upload and, with --skip-existing,
+    return the video ID of a previous upload of the same file (with no tasks).
+    If inventory (Inventory) is given, record the upload and warn about uploaded videos
+    with the same title or, with --skip-duplicate-titles, return the ID of one of them.
+    """
+    if upload_index and video_path != "-" and not options.live:
+        fingerprint = lib.fingerprint(video_path)
+        existing_video_id = upload_index.get(fingerprint)
+        if existing_video_id and options.skip_existing:
+            debug("Skipping already uploaded video: {0} ({1})".format(video_path,
+                                                                      existing_video_id))
+            return existing_video_id, []
+    else:
+        fingerprint = None
+    title = get_video_title(options, total_videos, index)
+    existing_video_ids = (inventory.get_videos_by_title(title) if inventory else [])
+    if existing_video_ids and options.skip_duplicate_titles:
+        debug("Skipping video with the title of an uploaded video: {0} ({1})".format(
+            video_path, existing_video_ids[0]))
+        return existing_video_ids[0], []
+    elif existing_video_ids:
+        debug("Warning: a video with the same title was already uploaded: {0}".format(
+            ", ".join(existing_video_ids)))
+    # Prepare the thumbnail (re-encode it if too large) while the video is uploaded
+    thumbnail_job = (thumbnail.prepare_in_background(options.thumb) if options.thumb else None)
+    upload = (upload_youtube_video_with_quota if options.wait_quota else upload_youtube_video)
+    video_id = upload(youtube, options, video_path, total_videos, index, bucket)
+    if fingerprint:
+        upload_index.add(fingerprint, os.path.getsize(video_path), video_id,
+                         os.path.abspath(video_path))
+    if inventory:
+        inventory.add_video(video_id, title)
+    video_url = WATCH_VIDEO_URL.format(id=video_id)
+    debug("Video URL: {0}".format(video_url))
+    if options.open_link:
+        open_link(video_url)  # Opens the Youtube Video's link in a webbrowser
+
+    # The follow-up calls reserve their quota when they run (the reservation
+    # of the upload only covers the calls made in its thread while it runs)
+    if options.wait_quota:
+        set_video_thumbnail = functools.partial(run_with_quota,
+                                                quota.get_cost("thumbnails.set"), set_thumbnail)
+        add_video_to_playlist = functools.partial(run_with_quota,
+                                                  get_playlist_quota_cost(1, ordered=False),
+                                                  playlists.add_video_to_playlist)
+    else:
+        set_video_thumbnail = set_thumbnail
+        add_video_to_playlist = playlists.add_video_to_playlist
+    tasks = []
+    if thumbnail_job:
+        tasks.append(scheduler.submit(set_video_thumbnail, video_id, thumbnail_job.result()))
+    if options.playlist and add_to_playlist:
+        tasks.append(scheduler.submit(add_video_to_playlist, video_id,
+                                      title=lib.to_utf8(options.playlist), privacy=options.privacy,
+                                      cache=playlist_cache))
+    return video_id, tasks
+
+
+def get_metadata_errors(options):
+    """Return the list of errors found in the metadata of a video."""
+    errors = []
+    if options.category and options.category not in categories.IDS:
+        errors.append("{0} is not a valid category".format(options.category))
+    if options.publish_at:
+        try:
+            manifest.parse_datetime(options.publish_at)
+        except ValueError as exc:
+            errors.append(str(exc))
+    return errors
+
+
+def get_video_errors(video_path, options):
+    """Return the list of errors found in a video file and its metadata."""
+    errors = []
+    if not os.path.isfile(video_path):
+        errors.append("Video file not found: {0}".format(video_path))
+    if not options.title:
+        errors.append("Missing title")
+    errors.extend(get_metadata_errors(options))
+    if options.thumb and not os.path.isfile(options.thumb):
+        errors.append("Thumbnail file not found: {0}".format(options.thumb))
+    elif options.thumb:
+        errors.extend(thumbnail.get_errors(options.thumb))
+        for warning in thumbnail.get_warnings(options.thumb):
+            debug("Warning: {0}".format(warning))
+    return errors
+
+
+def get_manifest_videos(options):
+    """
+    Return a list of (video_path, options) from the manifest. All rows are
+    validated before returning, so no upload starts if any is invalid.
+    """
+    videos = []
+    errors = []
+    for line_number, row in manifest.read_rows(options.manifest):
+        try:
+            row_options = manifest.get_row_options(options, row)
+        except manifest.ManifestError as exc:
+            row_errors = [str(exc)]
+        else:
+            row_errors = get_video_errors(row["path"], row_options)
+            videos.append((row["path"], row_options))
+        for error in row_errors:
+            errors.append("{0}:{1}: {2}".format(options.manifest, line_number, error))
+
+    if errors:
+        for error in errors:
+            debug(error)
+        raise manifest.ManifestError("Found {0} errors in manifest".format(len(errors)))
+    return videos
+
+
+def get_update_changes(options, manifest_path):
+    """
+    Return a list of (video_id, changes) from a manifest of updates (see
+    update.get_changes). All rows are validated before returning.
+    """
+    rows = []
+    errors = []
+    video_ids = set()
+    for line_number, row in manifest.read_rows(manifest_path):
+        try:
+            row_options = manifest.get_row_options(options, row, manifest.UPDATE_COLUMNS, "id")
+        except manifest.ManifestError as exc:
+            row_errors = [str(exc)]
+        else:
+            row_errors = get_metadata_errors(row_options)
+            if "title" in row and not row["title"]:
+                row_errors.append("Empty title")
+            if row["id"] in video_ids:
+                row_errors.append("Duplicated video: {0}".format(row["id"]))
+            video_ids.add(row["id"])
+            if not row_errors:
+                changes = update.get_changes(get_request_body(row_options), row)
+                rows.append((row["id"], changes))
+        for error in row_errors:
+            errors.append("{0}:{1}: {2}".format(manifest_path, line_number, error))
+
+    if errors:
+        for error in errors:
+            debug(error)
+        raise manifest.ManifestError("Found {0} errors in manifest".format(len(errors)))
+    return rows
+
+
+def get_split_videos(videos, options, directory):
+    """
+    Yield (video_path, options, total_videos, index, release) for the parts
+    of videos longer than --split-duration (cut in directory). Call release
+    with the part path when its upload is done.
+    """
+    for video_path, video_options, total_videos, index in videos:
+        splitter = split.VideoSplitter(video_path, options.split_duration, directory,
+                                       max_parts=options.parallel + 1)
+        if splitter.total == 1:
+            yield (video_path, video_options, total_videos, index, None)
+        else:
+            for part_index, part_path in enumerate(splitter):
+                yield (part_path, video_options, splitter.total, part_index, splitter.release)
 
 
-def parse_options_error(parser, options):
+def parse_options_error(parser, options, args, require_title=True):
     """Check errors in options."""
-    required_options = ["title"]
+    required_options = (["title"] if require_title and not options.manifest else [])
     missing = [opt for opt in required_options if not getattr(options, opt)]
     if missing:
         parser.print_usage()
         msg = "Some required option are missing: {0}".format(", ".join(missing))
         raise OptionsError(msg)
+    if options.parallel < 1:
+        raise OptionsError("Option --parallel must be a positive number")
+    if options.split_duration and (options.live or "-" in args):
+        raise OptionsError("Option --split-duration cannot be used with --live or standard input")
+    if options.manifest and args:
+        raise OptionsError("Videos cannot be passed as arguments with --manifest")
+    if options.progress not in progress.MODES:
+        raise OptionsError("Unknown progress mode: {0}".format(options.progress))
+    if options.progress_file and options.progress == "none":
+        raise OptionsError("Option --progress-file cannot be used with --progress=none")
+    if options.metrics_format not in metrics.FORMATS:
+        raise OptionsError("Unknown metrics format: {0}".format(options.metrics_format))
+    if options.max_rate:
+        try:
+            throttle.RateSchedule(options.max_rate)
+        except ValueError as exc:
+            raise OptionsError("Invalid --max-rate: {0}".format(exc))
+    if options.skip_duplicate_titles and not options.inventory:
+        raise OptionsError("Option --skip-duplicate-titles requires --inventory")
+    if options.thumb and not os.path.isfile(options.thumb):
+        raise OptionsError("Thumbnail file not found: {0}".format(options.thumb))
+    elif options.thumb:
+        errors = thumbnail.get_errors(options.thumb)
+        if errors:
+            raise OptionsError(errors[0])
+        for warning in thumbnail.get_warnings(options.thumb):
+            debug("Warning: {0}".format(warning))
+
+
+@contextmanager
+def get_upload_context(options):
+    """
+    Authenticate and yield the state shared by the uploads (an UploadContext
+    with the scheduler, playlist cache, batch, rate bucket, upload index and,
+    with --inventory, the inventory). Wait for the running uploads and clean
+    up on exit.
+    """
+    inventory = (Inventory(get_credentials_key(options)) if options.inventory else None)
+    if inventory and not inventory.is_synced():
+        inventory.close()
+        raise OptionsError("The inventory of the channel has not been synced "
+                           "(run: youtube-upload sync)")
+    credentials = get_credentials(options)
+    if not credentials:
+        raise AuthenticationError("Cannot get youtube resource")
+    from . import auth
+    if options.metrics_file:
+        metrics.enable(options.metrics_file, options.metrics_format)
+    if options.progress != "none":
+        progress.enable(options.progress, options.progress_file)
+    lib.set_retry_policy(lib.RetryPolicy(max_sleep=options.retry_max_sleep,
+                                         deadline=options.retry_deadline))
+    ledger = quota.QuotaLedger(get_quota_project(options), options.quota_budget)
+    quota.enable(ledger)
+    session = auth.Session(credentials)
+    scheduler = UploadScheduler(session.get_resource, workers=options.parallel)
+    upload_index = UploadIndex(get_credentials_key(options))
+    # A single bucket, so concurrent uploads share the rate
+    bucket = (throttle.TokenBucket(throttle.RateSchedule(options.max_rate))
+              if options.max_rate else None)
+    playlist_cache = (InventoryPlaylistCache(inventory) if inventory
+                      else get_playlist_cache(options))
+    UploadContext = struct("UploadContext", ["scheduler", "playlist_cache", "batch", "bucket",
+                                             "upload_index", "inventory"])
+    try:
+        yield UploadContext(scheduler=scheduler, playlist_cache=playlist_cache,
+                            batch=(BatchCollector() if options.batch else None),
+                            bucket=bucket, upload_index=upload_index, inventory=inventory)
+    finally:
+        scheduler.shutdown()
+        progress.disable()
+        metrics.disable()
+        quota.disable()
+        debug("Quota used today: {0}/{1} units".format(ledger.get_used(), ledger.budget))
+        upload_index.close()
+        if inventory:
+            inventory.close()
 
 
 def run_main(parser, options, args, output=sys.stdout):
     """Run the main scripts from the parsed options/args."""
-    parse_options_error(parser, options)
-    youtube = get_youtube_handler(options)
-
-    if youtube:
-        for index, video_path in enumerate(args):
-            video_id = upload_youtube_video(youtube, options, video_path, len(args), index)
-            video_url = WATCH_VIDEO_URL.format(id=video_id)
-            debug("Video URL: {0}".format(video_url))
-            if options.open_link:
-                open_link(video_url)  # Opens the Youtube Video's link in a webbrowser
-
-            if options.thumb:
-                youtube.thumbnails().set(videoId=video_id, media_body=options.thumb).execute()
-            if options.playlist:
-                playlists.add_video_to_playlist(youtube, video_id,
-                                                title=lib.to_utf8(options.playlist), privacy=options.privacy)
+    parse_options_error(parser, options, args)
+    if options.manifest:
+        videos = [(video_path, video_options, 1, 0)
+                  for (video_path, video_options) in get_manifest_videos(options)]
+    else:
+        videos = [(video_path, options, len(args), index)
+                  for (index, video_path) in enumerate(args)]
+    if options.split_duration:
+        split_directory = tempfile.mkdtemp(prefix="youtube-upload-")
+        videos = get_split_videos(videos, options, split_directory)
+    else:
+        split_directory = None
+        videos = ((video_path, video_options, total_videos, index, None)
+                  for (video_path, video_options, total_videos, index) in videos)
+    try:
+        with get_upload_context(options) as context:
+            jobs = []
+            playlist_videos = collections.OrderedDict()
+            errors = []
+            written = 0
+            for video_path, video_options, total_videos, index, release in videos:
+                # Start an upload only when a worker is free, so a failure stops the
+                # next uploads (a synchronous upload is done when submit returns)
+                context.scheduler.wait_for_worker([job for (job, _, _) in jobs])
+                written = write_video_ids(jobs, written, output, playlist_videos, errors)
+                if any(job.done() and job.exception() for (job, _, _) in jobs):
+                    break
+                job = context.scheduler.submit(upload_video_job, context.scheduler,
+                                               video_options, video_path, total_videos, index,
+                                               context.playlist_cache, False,
+                                               context.bucket, context.upload_index,
+                                               context.inventory)
+                if release:
+                    job.add_done_callback(lambda job, path=video_path: release(path))
+                jobs.append((job, video_path, video_options))
+            while written < len(jobs):
+                futures.wait([jobs[written][0]])
+                written = write_video_ids(jobs, written, output, playlist_videos, errors)
+            for job, video_path, video_options in jobs:
+                if not job.exception():
+                    video_id, tasks = job.result()
+                    for task in tasks:
+                        try:
+                            task.result()
+                        except Exception as exc:
+                            errors.append((video_path, exc))
+            # Videos are added once all are uploaded, so playlists keep the input order
+            # (i.e. the parts of split videos) with concurrent uploads. The videos
+            # uploaded are added even if others failed
+            errors.extend(add_videos_to_playlists(context.scheduler, playlist_videos,
+                                                  context.playlist_cache, options.batch,
+                                                  options.wait_quota))
+            raise_errors(errors)
+    finally:
+        if split_directory:
+            shutil.rmtree(split_directory)
+
+
+def write_video_ids(jobs, written, output, playlist_videos, errors):
+    """
+    Write the IDs of the uploads of jobs [(job, video_path, video_options)]
+    that are done, from index written until the first one still running (so
+    the IDs are in input order), and record their playlist and errors. Return
+    the index of the first job not written.
+    """
+    while written < len(jobs) and jobs[written][0].done():
+        job, video_path, video_options = jobs[written]
+        written += 1
+        if job.exception():
+            errors.append((video_path, job.exception()))
+            continue
+        video_id, tasks = job.result()
+        progress.write(video_id, output)
+        if video_options.playlist:
+            title = lib.to_utf8(video_options.playlist)
+            playlist_videos.setdefault(title, (video_options.privacy, []))[1].append(
+                (video_path, video_id))
+    return written
+
+
+def raise_errors(errors):
+    """
+    Report the errors [(video_path or playlist title, exception)] of the uploads
+    and raise the first one.
+    """
+    if len(errors) > 1:
+        for video_path, exc in errors:
+            debug("[{0}] Failed: {1}".format(video_path, exc))
+    if errors:
+        raise errors[0][1]
+
+
+def get_video_updates(scheduler, rows):
+    """
+    Fetch the current state of the videos of rows [(video_id, changes)] and
+    return (updates, missing): the updates [(video_id, body, parts)] of the
+    videos that changed, and the IDs of the videos not found.
+    """
+    parts = sorted(set(part for (video_id, changes) in rows for part in changes))
+    video_ids = [video_id for (video_id, changes) in rows]
+    jobs = [scheduler.submit(update.get_videos, video_ids[start:start + update.LIST_SIZE], parts)
+            for start in range(0, len(video_ids), update.LIST_SIZE)]
+    videos = {}
+    for job in jobs:
+        videos.update(job.result())
+    updates = []
+    missing = []
+    for video_id, changes in rows:
+        if video_id not in videos:
+            missing.append(video_id)
+            continue
+        body, changed_parts = update.apply_changes(videos[video_id], changes)
+        if changed_parts:
+            updates.append((video_id, body, changed_parts))
+    return updates, missing
+
+
+def run_update(parser, options, args, output=sys.stdout):
+    """Update the metadata of published videos from a manifest (only the changed ones)."""
+    if len(args) != 1:
+        parser.print_usage()
+        raise OptionsError("The update requires a manifest file")
+    if options.manifest or options.split_duration or options.live:
+        raise OptionsError("Options --manifest, --split-duration and --live "
+                           "cannot be used with the update")
+    parse_options_error(parser, options, [], require_title=False)
+    rows = get_update_changes(options, args[0])
+    with get_upload_context(options) as context:
+        scheduler = context.scheduler
+        updates, missing = get_video_updates(scheduler, rows)
+        debug("Updating {0} of {1} videos ({2} up to date, {3} not found)".format(
+            len(updates), len(rows), len(rows) - len(updates) - len(missing), len(missing)))
+        cost = quota.get_cost("videos.update")
+        if context.batch is not None:
+            youtube = scheduler.youtube()
+            for start in range(0, len(updates), context.batch.batch_size):
+                batch_updates = updates[start:start + context.batch.batch_size]
+                for video_id, body, parts in batch_updates:
+                    context.batch.add(video_id, update.get_update_request, body, parts)
+                if options.wait_quota:
+                    run_with_quota(cost * len(batch_updates), execute_batch, youtube,
+                                   context.batch)
+                else:
+                    execute_batch(youtube, context.batch)
+        else:
+            update_video = (functools.partial(run_with_quota, cost, update.update_video)
+                            if options.wait_quota else update.update_video)
+            jobs = [scheduler.submit(update_video, body, parts)
+                    for (video_id, body, parts) in updates]
+            for job in jobs:
+                job.result()
+        for video_id, body, parts in updates:
             output.write(video_id + "\n")
+    if missing:
+        for video_id in missing:
+            debug("Video not found: {0}".format(video_id))
+        raise RequestError("{0} videos not found".format(len(missing)))
+
+
+def run_sync(parser, options, args):
+    """Sync the inventory of the channel: its uploads, playlists and playlist items."""
+    if args:
+        parser.print_usage()
+        raise OptionsError("The sync takes no arguments")
+    # The inventory is synced here, the context does not require a synced one
+    options.inventory = False
+    parse_options_error(parser, options, args, require_title=False)
+    inventory = Inventory(get_credentials_key(options))
+    try:
+        with get_upload_context(options) as context:
+            scheduler = context.scheduler
+            youtube = scheduler.youtube()
+            uploads_playlist_id = inventory.sync_channel(youtube)
+            pages = [inventory.sync_playlists(youtube)]
+            # The pages of every playlist are fetched in order, playlists concurrently
+            playlist_ids = [uploads_playlist_id] + inventory.get_playlist_ids()
+            jobs = [scheduler.submit(inventory.sync_playlist_items, playlist_id)
+                    for playlist_id in playlist_ids]
+            pages.extend(job.result() for job in jobs)
+            inventory.set_synced()
+        fetched, not_modified = [sum(values) for values in zip(*pages)]
+        debug("Synced inventory: {0} videos, {1} playlists, {2} playlist items "
+              "({3} pages fetched, {4} not modified)".format(
+                  *(inventory.get_counts() + (fetched, not_modified))))
+    finally:
+        inventory.close()
+
+
+def enqueue_daemon_video(queue, options, video_path):
+    """Add the upload of a video (with the metadata of its sidecar file) to the queue."""
+    try:
+        row = manifest.read_sidecar(video_path)
+        row.setdefault("title", options.title or
+                       os.path.splitext(os.path.basename(video_path))[0])
+        errors = get_video_errors(video_path, manifest.get_row_options(options, row))
+    except manifest.ManifestError as exc:
+        errors = [str(exc)]
+    if errors:
+        for error in errors:
+            debug("{0}: {1}".format(video_path, error))
     else:
-        raise AuthenticationError("Cannot get youtube resource")
+        row["path"] = os.path.abspath(video_path)
+        if queue.add(row["path"], lib.fingerprint(video_path), row):
+            debug("Queued video: {0}".format(video_path))
+
+
+def check_daemon_job(queue, job_id, job, output):
+    """
+    Update the queue with the result of a job (future of upload_video_job) and
+    return True, or return False if the job (or its tasks) is still running.
+    """
+    if not job.done():
+        return False
+    try:
+        video_id, tasks = job.result()
+        if not all(task.done() for task in tasks):
+            return False
+        for task in tasks:
+            task.result()
+    except Exception as exc:
+        debug("Upload job {0} failed: {1}".format(job_id, exc))
+        queue.fail(job_id, str(exc))
+    else:
+        queue.finish(job_id, video_id)
+        progress.write(video_id, output)
+    return True
+
+
+def run_daemon(parser, options, args, output=sys.stdout):
+    """Watch a directory and upload the videos that appear in it (until interrupted)."""
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        parser.print_usage()
+        raise OptionsError("The daemon requires a directory to watch")
+    if options.manifest or options.split_duration or options.live or options.batch:
+        raise OptionsError("Options --manifest, --split-duration, --live and --batch "
+                           "cannot be used with the daemon")
+    parse_options_error(parser, options, args, require_title=False)
+    directory = args[0]
+    # Interrupted uploads continue their session, and videos uploaded before the
+    # daemon stopped (but whose job was not marked as done) are not uploaded again
+    options.resume = options.skip_existing = True
+    queue = daemon.JobQueue(options.queue_file)
+    recovered = queue.recover()
+    if recovered:
+        debug("Queued again {0} interrupted jobs".format(recovered))
+    watcher = daemon.get_watcher(directory)
+    stable_files = daemon.StableFiles(directory, options.stable_time)
+    debug("Watching directory: {0}".format(directory))
+    try:
+        with get_upload_context(options) as context:
+            try:
+                run_daemon_loop(context, options, queue, watcher, stable_files, output)
+            except KeyboardInterrupt:
+                from . import upload_video
+                debug("Interrupted, stopping (the running uploads continue at the next start)")
+                upload_video.interrupt()
+    finally:
+        watcher.close()
+        queue.close()
+
+
+def run_daemon_loop(context, options, queue, watcher, stable_files, output):
+    """Queue the stable files of the directory and run their uploads (until interrupted)."""
+    running = {}
+    while 1:
+        video_paths, pending = stable_files.scan()
+        for video_path in video_paths:
+            enqueue_daemon_video(queue, options, video_path)
+        for job_id, job in list(running.items()):
+            if check_daemon_job(queue, job_id, job, output):
+                del running[job_id]
+        while len(running) < options.parallel:
+            next_job = queue.start_next()
+            if not next_job:
+                break
+            job_id, video_path, row = next_job
+            video_options = manifest.get_row_options(options, row)
+            running[job_id] = context.scheduler.submit(
+                upload_video_job, context.scheduler, video_options, video_path, 1, 0,
+                context.playlist_cache, True, context.bucket, context.upload_index,
+                context.inventory)
+        watcher.wait(1 if (running or pending) else options.poll_interval)
 
 
 def main(arguments):
     """Upload videos to Youtube."""
     usage = """Usage: %prog [OPTIONS] VIDEO [VIDEO2 ...]
+       %prog daemon [OPTIONS] DIRECTORY
+       %prog update [OPTIONS] MANIFEST
+       %prog sync [OPTIONS]
 
-    Upload videos to Youtube."""
+    Upload videos to Youtube. The daemon uploads the videos that appear in
+    DIRECTORY, with the metadata of their sidecar files (VIDEO.json). The
+    update sets the metadata of published videos from MANIFEST (columns: id,
+    title, description, tags, category, privacy, publish_at), only for the
+    videos that changed. The sync stores the videos and playlists of the
+    channel, to be looked up by the uploads with --inventory."""
     parser = optparse.OptionParser(usage)
 
     # Video metadata
@@ -250,15 +907,31 @@ def main(arguments):
                       default=None, metavar="string",
                       help="Default audio language (ISO 639-1: en | fr | de | ...)")
     parser.add_option('', '--thumbnail', dest='thumb', type="string", metavar="FILE",
-                      help='Image file to use as video thumbnail (JPEG or PNG)')
+                      help='Image file to use as video thumbnail (JPEG or PNG, re-encoded if '
+                           'larger than 2 MB or 1280x720 when Pillow is installed)')
     parser.add_option('', '--playlist', dest='playlist', type="string",
                       help='Playlist title (if it does not exist, it will be created)')
+    parser.add_option('', '--playlist-cache-ttl', dest='playlist_cache_ttl', type="int",
+                      default=0, metavar="SECONDS",
+                      help='Cache the playlists on disk for SECONDS (default: 0, disabled)')
     parser.add_option('', '--title-template', dest='title_template',
                       type="string", default="{title} [{n}/{total}]", metavar="string",
                       help='Template for multiple videos (default: {title} [{n}/{total}])')
     parser.add_option('', '--embeddable', dest='embeddable', default=True,
                       help='Video is embeddable')
 
+    parser.add_option('', '--live', dest='live', action='store_true',
+                      help='Upload the videos while they are being written, until a file '
+                           'VIDEO.done exists (use "-" as VIDEO to upload the standard input)')
+    parser.add_option('', '--split-duration', dest='split_duration', type="int",
+                      metavar="SECONDS",
+                      help='Split videos longer than SECONDS in parts (requires ffmpeg), '
+                           'each part is uploaded while the next one is cut')
+    parser.add_option('', '--manifest', dest='manifest', type="string", metavar="FILE",
+                      help='CSV or JSON lines file with the videos to upload and their metadata '
+                           '(columns: path, title, description, tags, category, publish_at, '
+                           'thumbnail, playlist)')
+
     # Authentication
     parser.add_option('', '--client-secrets', dest='client_secrets',
                       type="string", help='Client secrets JSON file')
@@ -270,6 +943,74 @@ def main(arguments):
     # Additional options
     parser.add_option('', '--chunksize', dest='chunksize', type="int",
                       default=1024 * 1024 * 8, help='Update file chunksize')
+    parser.add_option('', '--adaptive-chunksize', dest='adaptive_chunksize',
+                      action='store_true',
+                      help='Adapt the chunksize to the measured throughput of the upload')
+    parser.add_option('', '--chunk-target-time', dest='chunk_target_time', type="float",
+                      default=10.0, metavar="SECONDS",
+                      help='Adaptive chunksize: target upload time per chunk (default: 10)')
+    parser.add_option('', '--min-chunksize', dest='min_chunksize', type="int",
+                      default=1024 * 1024, help='Adaptive chunksize: minimum chunksize')
+    parser.add_option('', '--max-chunksize', dest='max_chunksize', type="int",
+                      default=1024 * 1024 * 256, help='Adaptive chunksize: maximum chunksize')
+    parser.add_option('', '--max-rate', dest='max_rate', type="string",
+                      metavar="RATE|HH:MM-HH:MM=RATE,...",
+                      help='Maximum upload rate in bytes/second (suffixes: K, M, G) shared by all '
+                           'uploads, optionally by time of day (e.g. "08:00-20:00=2M,20:00-08:00=20M")')
+    parser.add_option('', '--parallel', dest='parallel', type="int", default=1,
+                      metavar="N", help='Number of videos to upload concurrently (default: 1)')
+    parser.add_option('', '--batch', dest='batch', action='store_true',
+                      help='Add the videos to the playlist with batch requests '
+                           '(update: send the updates in batch requests)')
+    parser.add_option('', '--stable-time', dest='stable_time', type="float",
+                      default=daemon.STABLE_TIME, metavar="SECONDS",
+                      help='Daemon: upload files unchanged for SECONDS (default: {0})'
+                           .format(daemon.STABLE_TIME))
+    parser.add_option('', '--poll-interval', dest='poll_interval', type="float",
+                      default=daemon.POLL_INTERVAL, metavar="SECONDS",
+                      help='Daemon: check the directory every SECONDS if there are no '
+                           'changes (default: {0})'.format(daemon.POLL_INTERVAL))
+    parser.add_option('', '--queue-file', dest='queue_file', type="string", metavar="FILE",
+                      help='Daemon: file of the jobs queue '
+                           '(default: ~/.cache/youtube-upload/queue.sqlite)')
+    parser.add_option('', '--resume', dest='resume', action='store_true',
+                      help='Resume interrupted uploads of the same files instead of starting again')
+    parser.add_option('', '--skip-existing', dest='skip_existing', action='store_true',
+                      help='Do not upload files with the same content as a previous upload, '
+                           'write its video ID instead')
+    parser.add_option('', '--inventory', dest='inventory', action='store_true',
+                      help='Look up playlists and titles of uploaded videos in the inventory '
+                           'of the channel (see sync) instead of the API')
+    parser.add_option('', '--skip-duplicate-titles', dest='skip_duplicate_titles',
+                      action='store_true',
+                      help='With --inventory, do not upload videos with the title of an '
+                           'uploaded video, write its video ID instead')
+    parser.add_option('', '--quota-budget', dest='quota_budget', type="int",
+                      default=quota.DEFAULT_BUDGET, metavar="UNITS",
+                      help='Daily API quota of the project (default: {0})'
+                           .format(quota.DEFAULT_BUDGET))
+    parser.add_option('', '--wait-quota', dest='wait_quota', action='store_true',
+                      help='Wait for the daily quota reset (midnight Pacific Time) to '
+                           'upload videos beyond the quota budget')
+    parser.add_option('', '--retry-max-sleep', dest='retry_max_sleep', type="float",
+                      default=64.0, metavar="SECONDS",
+                      help='Maximum wait between retries of transient errors (default: 64)')
+    parser.add_option('', '--retry-deadline', dest='retry_deadline', type="float",
+                      default=None, metavar="SECONDS",
+                      help='Do not retry errors if SECONDS have passed since the first attempt')
+    parser.add_option('', '--metrics-file', dest='metrics_file', type="string", metavar="FILE",
+                      help='Write metrics of the uploads (chunks, retries, API calls) to FILE')
+    parser.add_option('', '--metrics-format', dest='metrics_format', type="string",
+                      default="jsonl", metavar="FORMAT",
+                      help='Format of the metrics file: jsonl (default) | prometheus')
+    parser.add_option('', '--progress', dest='progress', type="string", default="bar",
+                      metavar="MODE",
+                      help='Progress of the uploads: bar (default, aggregated) | '
+                           'json (JSON lines) | none')
+    parser.add_option('', '--progress-file', dest='progress_file', type="string",
+                      metavar="FILE",
+                      help='Write the progress to FILE (a named pipe or /dev/fd/N for a '
+                           'file descriptor) instead of stderr, apart from the messages')
     parser.add_option('', '--open-link', dest='open_link', action='store_true',
                       help='Opens a url in a web browser to display the uploaded video')
 
@@ -279,8 +1020,16 @@ def main(arguments):
         with open(options.description_file, encoding="utf-8") as file:
             options.description = file.read()
 
+    import googleapiclient.errors
     try:
-        run_main(parser, options, args)
+        if args[:1] == ["daemon"]:
+            run_daemon(parser, options, args[1:])
+        elif args[:1] == ["update"]:
+            run_update(parser, options, args[1:])
+        elif args[:1] == ["sync"]:
+            run_sync(parser, options, args[1:])
+        else:
+            run_main(parser, options, args)
     except googleapiclient.errors.HttpError as error:
         response = bytes.decode(error.content, encoding=lib.get_encoding()).strip()
         raise RequestError(u"Server response: {0}".format(response))
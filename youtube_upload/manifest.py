@@ -0,0 +1,117 @@
+"""Read videos and their metadata from a manifest file (CSV or JSON lines)."""
+import io
+import os
+import csv
+import copy
+import json
+import datetime
+
+# Manifest column -> attribute in the command-line options
+COLUMNS = {
+    "path": None,
+    "title": "title",
+    "description": "description",
+    "tags": "tags",
+    "category": "category",
+    "publish_at": "publish_at",
+    "thumbnail": "thumb",
+    "playlist": "playlist",
+}
+
+# Columns of the manifests of updates (of published videos, by ID)
+UPDATE_COLUMNS = {
+    "id": None,
+    "title": "title",
+    "description": "description",
+    "tags": "tags",
+    "category": "category",
+    "privacy": "privacy",
+    "publish_at": "publish_at",
+}
+
+DATETIME_FORMATS = ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.%f%z",
+                    "%Y-%m-%dT%H:%M:%S%z"]
+
+
+class ManifestError(Exception): pass
+
+
+def parse_datetime(string):
+    """Return datetime from an ISO 8601 string (raise ValueError if not valid)."""
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(string, datetime_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date (ISO 8601 expected): {0}".format(string))
+
+
+def read_rows(path):
+    """Yield (line_number, row) for each row in a manifest (.csv or JSON lines) file."""
+    with io.open(path, encoding="utf-8") as fd:
+        if path.lower().endswith(".csv"):
+            reader = csv.DictReader(fd)
+            for row in reader:
+                # DictReader puts the values without a column in the header under None
+                if None in row:
+                    raise ManifestError("{0}:{1}: Too many fields ({2} columns in the "
+                                        "header)".format(path, reader.line_num,
+                                                         len(reader.fieldnames)))
+                yield reader.line_num, dict((k, v) for (k, v) in row.items() if v)
+        else:
+            for line_number, line in enumerate(fd, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    raise ManifestError("{0}:{1}: {2}".format(path, line_number, exc))
+                if not isinstance(row, dict):
+                    raise ManifestError("{0}:{1}: Expected a JSON object".format(path,
+                                                                                line_number))
+                yield line_number, row
+
+
+def get_sidecar_path(video_path):
+    """Return the path of the sidecar metadata file of a video (VIDEO.json)."""
+    return video_path + ".json"
+
+
+def read_sidecar(video_path):
+    """
+    Return the row (with the columns of a manifest) of a video from its sidecar
+    JSON file, if any. Relative paths are relative to the video directory.
+    """
+    row = {}
+    sidecar_path = get_sidecar_path(video_path)
+    if os.path.isfile(sidecar_path):
+        with io.open(sidecar_path, encoding="utf-8") as fd:
+            try:
+                row = json.load(fd)
+            except ValueError as exc:
+                raise ManifestError("{0}: {1}".format(sidecar_path, exc))
+        if not isinstance(row, dict):
+            raise ManifestError("{0}: Expected a JSON object".format(sidecar_path))
+    if row.get("thumbnail"):
+        row["thumbnail"] = os.path.join(os.path.dirname(video_path), row["thumbnail"])
+    row["path"] = video_path
+    return row
+
+
+def get_row_options(options, row, columns=COLUMNS, key_column="path"):
+    """
+    Return a copy of options updated with the metadata of a manifest row
+    (with the columns, key_column is required).
+    """
+    unknown = set(row) - set(columns)
+    if unknown:
+        raise ManifestError("Unknown columns: {0}".format(", ".join(sorted(unknown))))
+    if not row.get(key_column):
+        raise ManifestError("Missing column: {0}".format(key_column))
+    row_options = copy.copy(options)
+    for column, value in row.items():
+        if column == "tags" and isinstance(value, list):
+            value = ", ".join(value)
+        if columns[column]:
+            setattr(row_options, columns[column], value)
+    return row_options
@@ -0,0 +1,109 @@
+"""
+Record metrics of the uploads (chunks, retries, API calls) and export them
+as JSON lines (one event per line) or as a Prometheus textfile.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+FORMATS = ("jsonl", "prometheus")
+
+# Event -> [(Prometheus metric, event field to sum or None to count, labels)]
+PROMETHEUS_METRICS = {
+    "chunk": [
+        ("youtube_upload_chunks_total", None, []),
+        ("youtube_upload_chunk_bytes_total", "bytes", []),
+        ("youtube_upload_chunk_seconds_total", "seconds", []),
+    ],
+    "retry": [
+        ("youtube_upload_retries_total", None, ["error"]),
+        ("youtube_upload_backoff_seconds_total", "wait", ["error"]),
+    ],
+    "api_call": [
+        ("youtube_upload_api_calls_total", None, ["call"]),
+        ("youtube_upload_api_call_seconds_total", "seconds", ["call"]),
+    ],
+    "upload": [
+        ("youtube_upload_uploads_total", None, []),
+        ("youtube_upload_upload_bytes_total", "bytes", []),
+        ("youtube_upload_upload_seconds_total", "seconds", []),
+    ],
+}
+
+
+class Metrics(object):
+    """
+    Write events to path: JSON lines are appended as events are recorded,
+    the Prometheus textfile is written (with totals) on close.
+    """
+
+    def __init__(self, path, format="jsonl"):
+        self.path = path
+        self.format = format
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.fd = (open(path, "a") if format == "jsonl" else None)
+
+    def record(self, event, **fields):
+        with self.lock:
+            if self.fd:
+                self.fd.write(json.dumps(dict(event=event, time=time.time(), **fields)) + "\n")
+                self.fd.flush()
+            for name, field, labels in PROMETHEUS_METRICS.get(event, []):
+                key = (name, tuple((label, fields.get(label)) for label in labels))
+                self.totals[key] = self.totals.get(key, 0) + (fields[field] if field else 1)
+
+    def _write_prometheus(self):
+        lines = []
+        for (name, labels), value in sorted(self.totals.items()):
+            labels_string = ",".join('{0}="{1}"'.format(k, v) for (k, v) in labels)
+            lines.append("{0}{1} {2}".format(name, "{" + labels_string + "}"
+                                             if labels else "", value))
+        # Write atomically, the node exporter may read the file at any time
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as fd:
+            fd.write("\n".join(lines) + "\n")
+        getattr(os, "replace", os.rename)(temp_path, self.path)
+
+    def close(self):
+        with self.lock:
+            if self.fd:
+                self.fd.close()
+                self.fd = None
+            elif self.format == "prometheus":
+                self._write_prometheus()
+
+
+_metrics = None
+
+
+def enable(path, format="jsonl"):
+    """Start recording metrics to path."""
+    global _metrics
+    _metrics = Metrics(path, format)
+
+
+def disable():
+    """Stop recording metrics and write the pending ones."""
+    global _metrics
+    if _metrics:
+        _metrics.close()
+        _metrics = None
+
+
+def record(event, **fields):
+    """Record an event (chunk, retry, api_call, upload) if metrics are enabled."""
+    if _metrics:
+        _metrics.record(event, **fields)
+
+
+@contextmanager
+def timed(event, **fields):
+    """Record an event with the time spent in the block (field: seconds)."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(event, seconds=time.time() - start, **fields)
@@ -1,53 +1,315 @@
+import os
+import json
+import time
 import locale
+import threading
 
-from .lib import debug
+from .lib import debug, execute, get_error_reason
+from .batch import BatchCollector, check_results
+
+# Serialize lookup/creation so concurrent uploads do not create the same playlist twice
+_playlist_lock = threading.Lock()
+
+# Request only the fields needed to map titles to IDs
+PLAYLIST_FIELDS = "nextPageToken,items(id,snippet(title))"
+
+# Request only the fields needed to check the order of the items
+PLAYLIST_ITEM_FIELDS = "nextPageToken,items(id,snippet(resourceId(videoId)))"
+
+def _get_title(item):
+    t = item.get("snippet", {}).get("title")
+    current_encoding = locale.getpreferredencoding()
+    return (t.encode(current_encoding) if hasattr(t, 'decode') else t)
+
+def get_playlists(youtube):
+    """Return dictionary {title: id} with all the user's playlists."""
+    playlists = youtube.playlists()
+    request = playlists.list(mine=True, part="id,snippet", maxResults=50,
+                             fields=PLAYLIST_FIELDS)
+    playlist_ids = {}
+
+    while request:
+        results = execute(request)
+        for item in results["items"]:
+            playlist_ids.setdefault(_get_title(item), item.get("id"))
+        request = playlists.list_next(request, results)
+    return playlist_ids
 
 def get_playlist(youtube, title):
     """Return users's playlist ID by title (None if not found)"""
     playlists = youtube.playlists()
-    request = playlists.list(mine=True, part="id,snippet")
-    current_encoding = locale.getpreferredencoding()
-    
+    request = playlists.list(mine=True, part="id,snippet", maxResults=50,
+                             fields=PLAYLIST_FIELDS)
+
     while request:
-        results = request.execute()
+        results = execute(request)
         for item in results["items"]:
-            t = item.get("snippet", {}).get("title")
-            existing_playlist_title = (t.encode(current_encoding) if hasattr(t, 'decode') else t)
-            if existing_playlist_title == title:
+            if _get_title(item) == title:
                 return item.get("id")
         request = playlists.list_next(request, results)
 
+class PlaylistCache(object):
+    """
+    Map of the user's playlist titles to IDs, so the playlists are listed only
+    once. Entries expire after ttl seconds (None: never); if path is given, the
+    map is also persisted to that file. A title not found is looked up again
+    in the API (the playlist may have been created elsewhere since the listing).
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.playlist_ids = None
+        self.updated = None
+
+    def _is_fresh(self, updated):
+        return self.ttl is None or time.time() - updated < self.ttl
+
+    def _load(self, youtube):
+        """Load the entries (from the file if fresh). Return True if listed in the API."""
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as fd:
+                try:
+                    data = json.load(fd)
+                    playlist_ids, updated = data["playlists"], data["updated"]
+                except (ValueError, KeyError, TypeError):
+                    debug("Ignoring corrupt playlist cache: {0}".format(self.path))
+                    playlist_ids = updated = None
+            if playlist_ids is not None and self._is_fresh(updated):
+                self.playlist_ids, self.updated = playlist_ids, updated
+                return False
+        self._list(youtube)
+        return True
+
+    def _list(self, youtube):
+        self.playlist_ids, self.updated = get_playlists(youtube), time.time()
+        self._save()
+
+    def _save(self):
+        if self.path:
+            # Write atomically, other processes may read the file at any time
+            temp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+            with open(temp_path, "w") as fd:
+                json.dump(dict(updated=self.updated, playlists=self.playlist_ids), fd)
+            getattr(os, "replace", os.rename)(temp_path, self.path)
+
+    def get(self, youtube, title):
+        """Return playlist ID by title (None if not found)."""
+        listed = False
+        if self.playlist_ids is None or not self._is_fresh(self.updated):
+            listed = self._load(youtube)
+        if title not in self.playlist_ids and not listed:
+            debug("Playlist not in the cache, listing the playlists: {0}".format(title))
+            self._list(youtube)
+        return self.playlist_ids.get(title)
+
+    def add(self, title, playlist_id):
+        """Add a new playlist to the cache."""
+        if self.playlist_ids is not None:
+            self.playlist_ids[title] = playlist_id
+            self._save()
+
+    def invalidate(self):
+        """Remove all entries, so the next lookup lists the playlists again."""
+        self.playlist_ids = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
 def create_playlist(youtube, title, privacy):
     """Create a playlist by title and return its ID"""
     debug("Creating playlist: {0}".format(title))
-    response = youtube.playlists().insert(part="snippet,status", body={
+    request = youtube.playlists().insert(part="snippet,status", body={
         "snippet": {
             "title": title,
         },
         "status": {
             "privacyStatus": privacy,
         }
-    }).execute()
-    return response.get("id")
+    })
+    return execute(request).get("id")
+
+def _get_playlist_item_snippet(playlist_id, video_id, position=None):
+    snippet = {
+        "playlistId": playlist_id,
+        "resourceId": {
+            "kind": "youtube#video",
+            "videoId": video_id,
+        }
+    }
+    if position is not None:
+        snippet["position"] = position
+    return snippet
+
+def get_playlist_item_request(youtube, playlist_id, video_id, position=None):
+    """
+    Return the (not executed) request to add video to playlist (by identifier),
+    at position if given (at the end otherwise).
+    """
+    return youtube.playlistItems().insert(part="snippet", body={
+        "snippet": _get_playlist_item_snippet(playlist_id, video_id, position),
+    })
+
+def get_playlist_items(youtube, playlist_id):
+    """Return the list of (item_id, video_id) of a playlist (by identifier), in order."""
+    playlist_items = youtube.playlistItems()
+    request = playlist_items.list(playlistId=playlist_id, part="id,snippet", maxResults=50,
+                                  fields=PLAYLIST_ITEM_FIELDS)
+    items = []
+    while request:
+        results = execute(request)
+        for item in results["items"]:
+            items.append((item["id"], item["snippet"]["resourceId"]["videoId"]))
+        request = playlist_items.list_next(request, results)
+    return items
+
+def _is_manual_sort_error(exc):
+    import googleapiclient.errors
+    return (isinstance(exc, googleapiclient.errors.HttpError) and
+            get_error_reason(exc) == "manualSortRequired")
+
+def _get_inserted_item(response):
+    snippet = response["snippet"]
+    return response["id"], snippet["resourceId"]["videoId"], snippet.get("position")
+
+def _insert_videos(youtube, playlist_id, video_ids, start, batch=False, labels=None):
+    """
+    Insert videos in a playlist at positions start, start + 1, ... and return
+    the items inserted [(item_id, video_id, position)], or None if the playlist
+    is not sorted manually (the videos are then added at the end). If batch,
+    insert them at the end with batch requests (the calls of a batch may run
+    in any order, so explicit positions could be past the end of the playlist)
+    and report the failed ones by label ({video_id: label}, i.e. the file).
+    """
+    if batch:
+        collector = BatchCollector()
+        for video_id in video_ids:
+            collector.add((labels or {}).get(video_id, video_id), get_playlist_item_request,
+                          playlist_id, video_id)
+        results = collector.execute(youtube)
+        check_results(results)
+        return [_get_inserted_item(response) for (key, response, exc) in results]
+    items = []
+    # Requests of the same resource reuse its (kept-alive) connection
+    for offset, video_id in enumerate(video_ids):
+        try:
+            response = execute(get_playlist_item_request(youtube, playlist_id, video_id,
+                                                         start + offset))
+        except Exception as exc:
+            if not _is_manual_sort_error(exc):
+                raise
+            debug("Playlist is not sorted manually, adding the videos at the end: "
+                  "{0}".format(playlist_id))
+            for other_video_id in video_ids[offset:]:
+                execute(get_playlist_item_request(youtube, playlist_id, other_video_id))
+            return None
+        items.append(_get_inserted_item(response))
+    return items
+
+def _fix_order(youtube, playlist_id, items, video_ids, start):
+    """
+    Move the items {video_id: item_id} so the videos are in the order of
+    video_ids from position start.
+    """
+    for offset, video_id in enumerate(video_ids):
+        try:
+            execute(youtube.playlistItems().update(part="snippet", body={
+                "id": items[video_id],
+                "snippet": _get_playlist_item_snippet(playlist_id, video_id, start + offset),
+            }))
+        except Exception as exc:
+            if not _is_manual_sort_error(exc):
+                raise
+            debug("Playlist is not sorted manually, the order cannot be fixed: "
+                  "{0}".format(playlist_id))
+            return
+
+def add_videos_to_existing_playlist(youtube, playlist_id, video_ids, batch=False,
+                                    labels=None):
+    """
+    Add videos to the end of a playlist (by identifier) in the order of video_ids,
+    with explicit positions, and verify the order with the positions of the
+    inserted items (fixing it if required). Videos already in the playlist are
+    not added again. If batch, the videos are inserted with batch requests
+    (failed ones reported by labels, see _insert_videos). Playlists not sorted
+    manually get the videos at the end, in the order the API sorts them.
+    Return the IDs of the videos added.
+    """
+    items = get_playlist_items(youtube, playlist_id)
+    existing_video_ids = set(video_id for (item_id, video_id) in items)
+    new_video_ids = []
+    for video_id in video_ids:
+        if video_id not in existing_video_ids and video_id not in new_video_ids:
+            new_video_ids.append(video_id)
+    if not new_video_ids:
+        return []
+    debug("Adding {0} videos to playlist: {1}".format(len(new_video_ids), playlist_id))
+    inserted = _insert_videos(youtube, playlist_id, new_video_ids, len(items), batch, labels)
+    if inserted is None or any(position is None for (_, _, position) in inserted):
+        return new_video_ids
+    # Items inserted later never move the previous ones, so the positions
+    # returned give the final order
+    inserted.sort(key=lambda item: item[2])
+    if [video_id for (item_id, video_id, position) in inserted] != new_video_ids:
+        debug("Fixing the order of the videos in playlist: {0}".format(playlist_id))
+        _fix_order(youtube, playlist_id,
+                   dict((video_id, item_id) for (item_id, video_id, _) in inserted),
+                   new_video_ids, len(items))
+    return new_video_ids
 
 def add_video_to_existing_playlist(youtube, playlist_id, video_id):
     """Add video to playlist (by identifier) and return the playlist ID."""
     debug("Adding video to playlist: {0}".format(playlist_id))
-    return youtube.playlistItems().insert(part="snippet", body={
-        "snippet": {
-            "playlistId": playlist_id,
-            "resourceId": {
-                "kind": "youtube#video",
-                "videoId": video_id,
-            }
-        }
-    }).execute()
-    
-def add_video_to_playlist(youtube, video_id, title, privacy="public"):
+    return execute(get_playlist_item_request(youtube, playlist_id, video_id))
+
+def get_or_create_playlist(youtube, title, privacy="public", cache=None):
+    """
+    Return playlist ID by title, create the playlist if not found. Use the
+    PlaylistCache cache, if given, to get the playlist ID.
+    """
+    with _playlist_lock:
+        playlist_id = (cache.get(youtube, title) if cache else get_playlist(youtube, title))
+        if not playlist_id:
+            playlist_id = create_playlist(youtube, title, privacy)
+            if cache:
+                cache.add(title, playlist_id)
+        return playlist_id
+
+def add_videos_to_playlist(youtube, video_ids, title, privacy="public", cache=None, batch=False,
+                           labels=None):
+    """
+    Add videos to playlist (by title) in the order of video_ids (see
+    add_videos_to_existing_playlist) and return the IDs of the videos added.
+    """
+    import googleapiclient.errors
+    playlist_id = get_or_create_playlist(youtube, title, privacy, cache)
+    if playlist_id:
+        try:
+            return add_videos_to_existing_playlist(youtube, playlist_id, video_ids, batch,
+                                                   labels)
+        except googleapiclient.errors.HttpError as exc:
+            if not cache or exc.resp.status != 404:
+                raise
+            debug("Playlist not found, the cache is stale: {0}".format(playlist_id))
+            with _playlist_lock:
+                cache.invalidate()
+            return add_videos_to_playlist(youtube, video_ids, title, privacy, batch=batch,
+                                          labels=labels)
+    else:
+        debug("Error adding videos to playlist")
+
+def add_video_to_playlist(youtube, video_id, title, privacy="public", cache=None):
     """Add video to playlist (by title) and return the full response."""
-    playlist_id = get_playlist(youtube, title) or \
-        create_playlist(youtube, title, privacy)
+    import googleapiclient.errors
+    playlist_id = get_or_create_playlist(youtube, title, privacy, cache)
     if playlist_id:
-        return add_video_to_existing_playlist(youtube, playlist_id, video_id)
+        try:
+            return add_video_to_existing_playlist(youtube, playlist_id, video_id)
+        except googleapiclient.errors.HttpError as exc:
+            if not cache or exc.resp.status != 404:
+                raise
+            debug("Playlist not found, the cache is stale: {0}".format(playlist_id))
+            with _playlist_lock:
+                cache.invalidate()
+            return add_video_to_playlist(youtube, video_id, title, privacy)
     else:
         debug("Error adding video to playlist")
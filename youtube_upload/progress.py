@@ -0,0 +1,327 @@
+"""
+Report the progress of the uploads. Upload threads publish events (start,
+progress, finish) to a thread-safe bus and never write to the console; a
+background thread renders them, at most every INTERVAL seconds, as a line
+with the aggregated progress, throughput and ETA of all active uploads
+(bar), or as JSON lines for other programs (json). While the bar is redrawn
+in place on a terminal, the lines for that terminal are written by the bus too.
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+import itertools
+import threading
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import lib
+
+MODES = ("bar", "json", "none")
+
+# Seconds between redraws
+INTERVAL = 0.5
+
+# Seconds of progress used to compute the throughput
+RATE_WINDOW = 10.0
+
+
+class EventBus(object):
+    """
+    Thread-safe event bus: publishers only enqueue events, the subscribers
+    handle them in a background thread (handle(event, time, fields)) and
+    are called with tick(now) every interval seconds, and close(now) at the end.
+    """
+
+    def __init__(self, subscribers, interval=INTERVAL):
+        self.subscribers = subscribers
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, event, **fields):
+        self.queue.put((event, time.time(), fields))
+
+    def _run(self):
+        next_tick = time.time() + self.interval
+        while 1:
+            try:
+                item = self.queue.get(timeout=max(0, next_tick - time.time()))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            elif item:
+                for subscriber in self.subscribers:
+                    subscriber.handle(*item)
+            now = time.time()
+            if now >= next_tick:
+                for subscriber in self.subscribers:
+                    subscriber.tick(now)
+                next_tick = now + self.interval
+        for subscriber in self.subscribers:
+            subscriber.close(time.time())
+
+    def close(self):
+        """Deliver the pending events and stop the bus."""
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ProgressState(object):
+    """Aggregated state of the active uploads, built from the events."""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        # upload ID -> dictionary (label, total, completed)
+        self.uploads = collections.OrderedDict()
+        # (time, bytes sent by all uploads)
+        self.samples = collections.deque([(time.time(), 0)])
+        self.sent = 0
+        self.finished = 0
+        self.failed = 0
+
+    def handle(self, event, now, fields):
+        upload_id = fields["upload"]
+        if event == "start":
+            if not self.uploads:
+                # Do not count the time without uploads in the throughput
+                self.samples = collections.deque([(now, self.sent)])
+            self.uploads[upload_id] = dict(label=fields["label"], total=fields.get("total"),
+                                           completed=0)
+        elif event == "progress" and upload_id in self.uploads:
+            upload = self.uploads[upload_id]
+            self.sent += max(0, fields["completed"] - upload["completed"])
+            upload.update(total=fields["total"], completed=fields["completed"])
+            self.samples.append((now, self.sent))
+            while len(self.samples) > 2 and self.samples[1][0] <= now - self.window:
+                self.samples.popleft()
+        elif event == "finish" and upload_id in self.uploads:
+            del self.uploads[upload_id]
+            if fields.get("video_id"):
+                self.finished += 1
+            else:
+                self.failed += 1
+
+    def get_rate(self, now):
+        """Return the throughput (bytes/second) of all uploads in the last window."""
+        start_time, start_sent = self.samples[0]
+        return ((self.sent - start_sent) / (now - start_time) if now > start_time else 0.0)
+
+    def get_totals(self):
+        """Return (completed, total) bytes of the active uploads (total None if unknown)."""
+        completed = sum(upload["completed"] for upload in self.uploads.values())
+        totals = [upload["total"] for upload in self.uploads.values()]
+        return completed, (sum(totals) if None not in totals else None)
+
+    def get_eta(self, now):
+        """Return the seconds until the active uploads finish, or None if unknown."""
+        completed, total = self.get_totals()
+        rate = self.get_rate(now)
+        return ((total - completed) / rate if total is not None and rate > 0 else None)
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return "{0:.1f} {1}".format(size, unit)
+        size /= 1024.0
+    return "{0:.1f} GiB".format(size)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+
+
+class BarRenderer(object):
+    """
+    Write a line with the aggregated progress of the active uploads (redrawn
+    in place on a terminal, appended otherwise), only when it changed.
+    """
+
+    def __init__(self, fd=sys.stderr):
+        self.fd = fd
+        self.state = ProgressState()
+        self.tty = hasattr(fd, "isatty") and fd.isatty()
+        self.changed = False
+        self.line = ""
+        self.width = 0
+
+    def handle(self, event, now, fields):
+        if event == "message":
+            self.write_message(fields["message"], fields["fd"])
+            return
+        self.state.handle(event, now, fields)
+        self.changed = True
+
+    def write_message(self, message, fd):
+        """Write a message line to fd (on the same terminal), clearing and redrawing the bar."""
+        if self.tty and self.width:
+            self.fd.write("\r" + " " * self.width + "\r")
+            self.fd.flush()
+        print(message, file=fd)
+        fd.flush()
+        if self.tty and self.width:
+            self.fd.write(self.line)
+        self.fd.flush()
+
+    def get_line(self, now):
+        completed, total = self.state.get_totals()
+        uploads = len(self.state.uploads)
+        if not uploads:
+            return "Uploads: {0} done, {1} failed".format(self.state.finished,
+                                                        self.state.failed)
+        line = "Uploading {0} video{1}: ".format(uploads, "" if uploads == 1 else "s")
+        if total:
+            line += "{0:.1f}% ({1}/{2})".format(100.0 * completed / total,
+                                               format_size(completed), format_size(total))
+        else:
+            line += format_size(completed)
+        line += " {0}/s".format(format_size(self.state.get_rate(now)))
+        eta = self.state.get_eta(now)
+        if eta is not None:
+            line += " ETA {0}".format(format_duration(eta))
+        if self.state.finished or self.state.failed:
+            line += " [{0} done, {1} failed]".format(self.state.finished, self.state.failed)
+        return line
+
+    def tick(self, now):
+        if not self.changed:
+            return
+        self.changed = False
+        line = self.get_line(now)
+        if self.tty:
+            self.fd.write("\r" + line.ljust(self.width))
+            self.line = line
+            self.width = len(line)
+        else:
+            self.fd.write(line + "\n")
+        self.fd.flush()
+
+    def close(self, now):
+        self.tick(now)
+        if self.tty and self.width:
+            self.fd.write("\n")
+            self.fd.flush()
+
+
+class JsonRenderer(object):
+    """
+    Write the progress as JSON lines: the start and finish of the uploads as
+    they happen and, every tick with changes, the progress of every active
+    upload and the aggregate (with rate and ETA).
+    """
+
+    def __init__(self, fd=sys.stderr):
+        self.fd = fd
+        self.state = ProgressState()
+        self.changed = False
+
+    def _write(self, event, now, **fields):
+        self.fd.write(json.dumps(dict(event=event, time=round(now, 3), **fields)) + "\n")
+
+    def handle(self, event, now, fields):
+        self.state.handle(event, now, fields)
+        if event == "progress":
+            self.changed = True
+        else:
+            self._write(event, now, **fields)
+            self.fd.flush()
+
+    def tick(self, now):
+        if not self.changed:
+            return
+        self.changed = False
+        for upload_id, upload in self.state.uploads.items():
+            self._write("progress", now, upload=upload_id, **upload)
+        completed, total = self.state.get_totals()
+        eta = self.state.get_eta(now)
+        self._write("aggregate", now, active=len(self.state.uploads), completed=completed,
+                    total=total, rate=round(self.state.get_rate(now), 1),
+                    eta=(round(eta, 1) if eta is not None else None),
+                    finished=self.state.finished, failed=self.state.failed)
+        self.fd.flush()
+
+    def close(self, now):
+        self.tick(now)
+
+
+RENDERERS = {"bar": BarRenderer, "json": JsonRenderer}
+
+_bus = None
+_output = None
+# Whether the bar is redrawn in place on the terminal
+_redraw = False
+_upload_ids = itertools.count(1)
+
+
+def enable(mode="bar", path=None):
+    """
+    Start reporting progress (mode: bar or json) to path (appended; it may be
+    a named pipe or /dev/fd/N), or to stderr if no path is given.
+    """
+    global _bus, _output, _redraw
+    _output = (open(path, "a") if path else None)
+    renderer = RENDERERS[mode](_output or sys.stderr)
+    _bus = EventBus([renderer])
+    _redraw = getattr(renderer, "tty", False)
+    if _redraw:
+        lib.set_debug_handler(write)
+
+
+def disable():
+    """Render the pending events and stop reporting progress."""
+    global _bus, _output, _redraw
+    lib.set_debug_handler(None)
+    _redraw = False
+    if _bus:
+        _bus.close()
+        _bus = None
+    if _output:
+        _output.close()
+        _output = None
+
+
+def publish(event, **fields):
+    """Publish an event (start, progress, finish, message) if progress is enabled."""
+    if _bus:
+        _bus.publish(event, **fields)
+
+
+def write(obj, fd):
+    """
+    Write obj as a line to fd. If the bar is redrawn in place and fd is a
+    terminal, the bus writes it so it is not glued to the bar.
+    """
+    if _bus and _redraw and hasattr(fd, "isatty") and fd.isatty():
+        _bus.publish("message", message=obj, fd=fd)
+    else:
+        print(obj, file=fd)
+        fd.flush()
+
+
+def start(label, total=None):
+    """Publish the start of an upload of total bytes (None if unknown). Return its ID."""
+    upload_id = next(_upload_ids)
+    publish("start", upload=upload_id, label=label, total=total)
+    return upload_id
+
+
+def get_callback(upload_id):
+    """Return a progress callback (total_size, completed) of the upload."""
+    def _callback(total_size, completed):
+        publish("progress", upload=upload_id, total=total_size, completed=completed)
+    return _callback
+
+
+def finish(upload_id, video_id=None):
+    """Publish the end of an upload (failed if no video_id)."""
+    publish("finish", upload=upload_id, video_id=video_id)
@@ -0,0 +1,212 @@
+"""
+Account the daily quota of the Youtube API used by the calls of a project,
+and wait for the quota reset (midnight Pacific Time) when it is used up.
+"""
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+
+from . import lib
+
+# Default daily quota of a project (units)
+DEFAULT_BUDGET = 10000
+
+# Units per call (https://developers.google.com/youtube/v3/determine_quota_cost)
+COSTS = {
+    "videos.insert": 1600,
+    "videos.update": 50,
+    "videos.list": 1,
+    "thumbnails.set": 50,
+    "playlists.insert": 50,
+    "playlists.list": 1,
+    "playlistItems.insert": 50,
+    "playlistItems.list": 1,
+    "channels.list": 1,
+    "videoCategories.list": 1,
+}
+
+# Days of usage kept in the ledger
+HISTORY_DAYS = 7
+
+# Seconds between checks of the ledger while waiting for quota
+WAIT_INTERVAL = 300
+
+
+class QuotaError(Exception):
+    pass
+
+
+def get_cost(call):
+    """Return the quota units of an API call (i.e. "videos.insert")."""
+    return COSTS.get(call, 1 if call.endswith(".list") else 50)
+
+
+def _get_pacific_offset(utc):
+    """Return the UTC offset of the Pacific Time at the UTC datetime."""
+    # Daylight saving time: from the second Sunday of March (2:00 PST) to the
+    # first Sunday of November (2:00 PDT)
+    second_week_of_march = datetime.datetime(utc.year, 3, 8)
+    first_week_of_november = datetime.datetime(utc.year, 11, 1)
+    dst_start = second_week_of_march + datetime.timedelta(
+        days=(6 - second_week_of_march.weekday()) % 7, hours=10)
+    dst_end = first_week_of_november + datetime.timedelta(
+        days=(6 - first_week_of_november.weekday()) % 7, hours=9)
+    return datetime.timedelta(hours=(-7 if dst_start <= utc < dst_end else -8))
+
+
+def _get_pacific_time(timestamp=None):
+    utc = datetime.datetime.utcfromtimestamp(time.time() if timestamp is None else timestamp)
+    return utc + _get_pacific_offset(utc)
+
+
+def get_day(timestamp=None):
+    """Return the quota day (date in Pacific Time, YYYY-MM-DD) of a timestamp."""
+    return _get_pacific_time(timestamp).date().isoformat()
+
+
+def get_seconds_to_reset(timestamp=None):
+    """Return the seconds until the next quota reset (midnight Pacific Time)."""
+    now = _get_pacific_time(timestamp)
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1),
+                                         datetime.time())
+    return (midnight - now).total_seconds()
+
+
+class QuotaLedger(object):
+    """
+    Daily quota used by a project, persisted in a JSON file shared (with a
+    file lock) by all processes: {project: {day: {used, calls}}}. Uploads can
+    reserve the units they need, waiting for the quota reset if the budget is
+    used up; the calls they make (in the same thread) consume their reservation,
+    so they are not counted twice.
+    """
+
+    def __init__(self, project, budget=DEFAULT_BUDGET, path=None):
+        self.project = project
+        self.budget = budget
+        self.path = path or lib.get_cache_path("quota.json")
+        self.file_lock = lib.FileLock(self.path + ".lock")
+        self.condition = threading.Condition()
+        self.reserved = 0
+        # Units reserved and not yet charged by the reserve blocks of every thread
+        self.local = threading.local()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as fd:
+            try:
+                return json.load(fd)
+            except ValueError:
+                lib.debug("Ignoring corrupt quota ledger: {0}".format(self.path))
+                return {}
+
+    def _save(self, ledger):
+        temp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(temp_path, "w") as fd:
+            json.dump(ledger, fd)
+        getattr(os, "replace", os.rename)(temp_path, self.path)
+
+    def _update(self, update):
+        with self.condition, self.file_lock:
+            ledger = self._load()
+            days = ledger.setdefault(self.project, {})
+            day = days.setdefault(get_day(), dict(used=0, calls={}))
+            update(day)
+            for old_day in sorted(days)[:-HISTORY_DAYS]:
+                del days[old_day]
+            self._save(ledger)
+
+    def get_used(self):
+        """Return the units used today."""
+        with self.file_lock:
+            day = self._load().get(self.project, {}).get(get_day())
+        return (day["used"] if day else 0)
+
+    def charge(self, call, count=1):
+        """
+        Account count calls of type call (i.e. "videos.insert"). Inside a
+        reserve block, the units are taken from its reservation.
+        """
+        units = get_cost(call) * count
+
+        def update(day):
+            day["used"] += units
+            day["calls"][call] = day["calls"].get(call, 0) + count
+        with self.condition:
+            self._update(update)
+            reservations = getattr(self.local, "reservations", None)
+            if reservations:
+                consumed = min(reservations[-1], units)
+                reservations[-1] -= consumed
+                self.reserved -= consumed
+
+    def exhaust(self):
+        """Account the quota of today as used up (the API returned a quota error)."""
+        def update(day):
+            day["used"] = max(day["used"], self.budget)
+        self._update(update)
+
+    @contextmanager
+    def reserve(self, units):
+        """
+        Reserve units of quota while running the block, waiting for the quota
+        reset if the units are not available in the budget of today.
+        """
+        if units > self.budget:
+            raise QuotaError("Quota budget ({0} units) is less than the {1} units required"
+                             .format(self.budget, units))
+        with self.condition:
+            waiting = False
+            while self.get_used() + self.reserved + units > self.budget:
+                seconds = get_seconds_to_reset()
+                if not waiting:
+                    message = ("Waiting for {0} units of quota ({1} used and {2} reserved "
+                               "of {3}), reset in {4:.1f} hours")
+                    lib.debug(message.format(units, self.get_used(), self.reserved,
+                                             self.budget, seconds / 3600.0))
+                    waiting = True
+                self.condition.wait(min(seconds + 1, WAIT_INTERVAL))
+            self.reserved += units
+            reservations = self.local.__dict__.setdefault("reservations", [])
+            reservations.append(units)
+        try:
+            yield
+        finally:
+            with self.condition:
+                # Release the units not charged
+                self.reserved -= reservations.pop()
+                self.condition.notify_all()
+
+
+_ledger = None
+
+
+def enable(ledger):
+    """Account the API calls in the QuotaLedger ledger."""
+    global _ledger
+    _ledger = ledger
+
+
+def disable():
+    global _ledger
+    _ledger = None
+
+
+def get_ledger():
+    return _ledger
+
+
+def charge(call, count=1):
+    """Account an API call in the enabled ledger (if any)."""
+    if _ledger:
+        _ledger.charge(call, count)
+
+
+def exhaust():
+    """Account the quota as used up in the enabled ledger (if any)."""
+    if _ledger:
+        _ledger.exhaust()
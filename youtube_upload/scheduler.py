@@ -0,0 +1,68 @@
+"""Run upload tasks on a bounded pool of worker threads."""
+import threading
+from concurrent import futures
+
+
+class UploadScheduler(object):
+    """
+    Run tasks fun(youtube, *args, **kwargs) on a pool of worker threads.
+
+    httplib2.Http objects are not thread-safe, so every worker builds its
+    own YouTube resource using the get_youtube callback. With a single worker
+    tasks run synchronously in the calling thread.
+    """
+
+    def __init__(self, get_youtube, workers=1):
+        self.get_youtube = get_youtube
+        self.workers = workers
+        self.local = threading.local()
+        self.futures = []
+        # Follow-up tasks are submitted from the worker threads
+        self.lock = threading.Lock()
+        if workers > 1:
+            self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = None
+
+    def youtube(self):
+        """Return the YouTube resource of the current thread."""
+        if not hasattr(self.local, "youtube"):
+            self.local.youtube = self.get_youtube()
+        return self.local.youtube
+
+    def _run(self, fun, args, kwargs):
+        return fun(self.youtube(), *args, **kwargs)
+
+    def submit(self, fun, *args, **kwargs):
+        """Schedule fun(youtube, *args, **kwargs) and return a Future."""
+        if self.executor:
+            future = self.executor.submit(self._run, fun, args, kwargs)
+            # Keep only the pending futures (to cancel them on shutdown)
+            with self.lock:
+                self.futures = [f for f in self.futures if not f.done()] + [future]
+        else:
+            future = futures.Future()
+            try:
+                future.set_result(self._run(fun, args, kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+        return future
+
+    def wait_for_worker(self, jobs):
+        """
+        Wait until fewer than workers of jobs (Futures returned by submit) are
+        pending, so the next job submitted starts without waiting in the queue.
+        """
+        pending = [job for job in jobs if not job.done()]
+        while len(pending) >= self.workers:
+            futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            pending = [job for job in pending if not job.done()]
+
+    def shutdown(self):
+        """Cancel tasks not yet started and wait for the running ones."""
+        if self.executor:
+            with self.lock:
+                pending = list(self.futures)
+            for future in pending:
+                future.cancel()
+            self.executor.shutdown(wait=True)
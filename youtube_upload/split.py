@@ -0,0 +1,106 @@
+"""
+Split videos in parts with ffmpeg (stream copy, no re-encoding). Parts are
+cut in a background thread while the previous ones are being uploaded.
+"""
+import os
+import math
+import tempfile
+import threading
+import subprocess
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .lib import debug
+
+
+class SplitError(Exception): pass
+
+
+def _run(command):
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as exc:
+        raise SplitError("Cannot run {0}: {1}".format(command[0], exc))
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise SplitError("Error running {0}: {1}".format(command[0], stderr.decode("utf-8", "replace")))
+    return stdout.decode("utf-8", "replace")
+
+
+def get_duration(path):
+    """Return duration of a video (in seconds)."""
+    output = _run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                   "-of", "default=noprint_wrappers=1:nokey=1", path])
+    try:
+        return float(output.strip())
+    except ValueError:
+        raise SplitError("Cannot get duration of video: {0}".format(path))
+
+
+def cut(path, output_path, offset, duration):
+    """Cut a part of a video (from offset, in seconds) without re-encoding."""
+    _run(["ffmpeg", "-v", "error", "-ss", str(offset), "-i", path, "-t", str(duration),
+          "-map", "0", "-c", "copy", "-y", output_path])
+
+
+class VideoSplitter(object):
+    """
+    Iterate the parts of a video (part_duration seconds long) saved in a
+    subdirectory of directory of its own (videos with the same basename do not
+    share part files). At most max_parts parts exist at the same time: call
+    release when a part has been uploaded to delete it and let the next one be cut.
+    """
+
+    def __init__(self, path, part_duration, directory, max_parts=2):
+        self.path = path
+        self.part_duration = part_duration
+        self.duration = get_duration(path)
+        basename = os.path.splitext(os.path.basename(path))[0]
+        self.directory = tempfile.mkdtemp(prefix=basename + "-", dir=directory)
+        self.total = max(1, int(math.ceil(self.duration / part_duration)))
+        self.slots = threading.Semaphore(max_parts)
+        self.parts = queue.Queue()
+        self.cancelled = False
+
+    def get_part_path(self, index):
+        """Return the path of a part of the video (index starts at 0)."""
+        basename = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(self.directory, "{0}.part{1:03d}.mkv".format(basename, index + 1))
+
+    def _cut_parts(self):
+        try:
+            for index in range(self.total):
+                self.slots.acquire()
+                if self.cancelled:
+                    return
+                part_path = self.get_part_path(index)
+                offset = index * self.part_duration
+                debug("{0}: cut part {1}/{2} from position {3}".format(
+                    self.path, index + 1, self.total, offset))
+                cut(self.path, part_path, offset, self.part_duration)
+                self.parts.put(part_path)
+        except SplitError as exc:
+            self.parts.put(exc)
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._cut_parts)
+        thread.daemon = True
+        thread.start()
+        try:
+            for index in range(self.total):
+                part = self.parts.get()
+                if isinstance(part, SplitError):
+                    raise part
+                yield part
+        finally:
+            self.cancelled = True
+            self.slots.release()
+
+    def release(self, part_path):
+        """Delete an uploaded part, so the next one can be cut."""
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        self.slots.release()
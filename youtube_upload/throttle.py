@@ -0,0 +1,100 @@
+"""Limit the upload bandwidth shared by all the uploads of the process."""
+import re
+import time
+import datetime
+import threading
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(string):
+    """Return bytes/second from a string "N[K|M|G]" (e.g. "512K")."""
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)\s*$", string, re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid rate: {0}".format(string))
+    return float(match.group(1)) * UNITS[match.group(2).upper()]
+
+
+def _parse_time(string):
+    hours, minutes = string.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class RateSchedule(object):
+    """
+    Rates by time of day, from a string "RATE" or "HH:MM-HH:MM=RATE,...",
+    for example "08:00-20:00=2M,20:00-08:00=20M". No limit applies outside
+    the intervals.
+    """
+
+    def __init__(self, string):
+        self.intervals = []
+        for item in string.split(","):
+            if "=" not in item:
+                self.intervals.append((0, 24 * 60, parse_rate(item)))
+                continue
+            interval, rate = item.split("=", 1)
+            try:
+                start, end = [_parse_time(s) for s in interval.split("-")]
+            except ValueError:
+                raise ValueError("Invalid interval: {0}".format(interval))
+            self.intervals.append((start, end, parse_rate(rate)))
+
+    def get_rate(self, now=None):
+        """Return the rate (bytes/second) at time now (None if no limit)."""
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.intervals:
+            in_interval = (start <= minute < end if start <= end
+                           else minute >= start or minute < end)
+            if in_interval:
+                return rate
+
+
+class TokenBucket(object):
+    """
+    Token bucket shared by threads. Every call to consume reserves its bytes
+    in arrival order and sleeps (without holding the lock) until they are
+    available, so concurrent uploads get a fair share of the rate.
+    """
+
+    def __init__(self, schedule, burst_seconds=1.0):
+        self.schedule = schedule
+        self.burst_seconds = burst_seconds
+        self.tokens = 0.0
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        """Reserve size bytes and return the seconds to wait before sending them."""
+        rate = self.schedule.get_rate()
+        if not rate:
+            return 0
+        with self.lock:
+            now = time.time()
+            capacity = rate * self.burst_seconds
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate) - size
+            self.updated = now
+            return (-self.tokens / rate if self.tokens < 0 else 0)
+
+    def consume(self, size):
+        """Wait until size bytes can be sent."""
+        wait = self.reserve(size)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThrottledFile(object):
+    """File object whose reads are limited by a TokenBucket."""
+
+    def __init__(self, fd, bucket):
+        self.fd = fd
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.fd.read(size)
+        self.bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fd, name)
@@ -0,0 +1,185 @@
+"""
+Prepare thumbnails before they are set: validate the format, dimensions and
+size locally (instead of being rejected by the API after the transfer), and
+re-encode oversized images to a JPEG that fits MAX_WIDTH x MAX_HEIGHT and
+MAX_SIZE (with Pillow, if installed). Processed thumbnails are cached by the
+hash of the source image, and are prepared in the background while the video
+is uploaded.
+"""
+import io
+import os
+import struct
+import hashlib
+import threading
+
+from concurrent import futures
+
+from . import lib
+
+# Maximum size of a thumbnail accepted by the API
+MAX_SIZE = 2 * 1024 * 1024
+
+# Minimum width recommended, and the resolution larger images are resized to fit
+MIN_WIDTH = 640
+MAX_WIDTH, MAX_HEIGHT = 1280, 720
+
+# JPEG qualities tried, in order, until the thumbnail fits in MAX_SIZE
+QUALITIES = [90, 80, 70, 60, 50]
+
+# JPEG markers (Start Of Frame) that contain the dimensions of the image
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+_executor = futures.ThreadPoolExecutor(max_workers=2)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def get_image_module():
+    """
+    Return the Image module of Pillow (http://python-pillow.org, optional),
+    or None if not installed. It is imported when needed, so the startup is fast.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def _get_jpeg_dimensions(fd):
+    while 1:
+        marker = fd.read(2)
+        if len(marker) < 2 or marker[0:1] != b"\xff":
+            return None
+        marker_type = ord(marker[1:2])
+        if marker_type == 0x01 or 0xD0 <= marker_type <= 0xD9:
+            continue
+        data = fd.read(2)
+        if len(data) < 2:
+            return None
+        length, = struct.unpack(">H", data)
+        if marker_type in JPEG_SOF_MARKERS:
+            data = fd.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">xHH", data)
+            return width, height
+        fd.seek(length - 2, os.SEEK_CUR)
+
+
+def get_image_info(path):
+    """Return (format, width, height) of a JPEG or PNG image (read from its header), or None."""
+    with open(path, "rb") as fd:
+        header = fd.read(24)
+        if (header.startswith(b"\x89PNG\r\n\x1a\n") and header[12:16] == b"IHDR" and
+                len(header) == 24):
+            width, height = struct.unpack(">II", header[16:24])
+            return "png", width, height
+        elif header.startswith(b"\xff\xd8"):
+            fd.seek(2)
+            dimensions = _get_jpeg_dimensions(fd)
+            return (("jpeg",) + dimensions if dimensions else None)
+    return None
+
+
+def needs_processing(path, width, height):
+    """Return True if the thumbnail is too large (in size or dimensions) to be sent as is."""
+    return os.path.getsize(path) > MAX_SIZE or width > MAX_WIDTH or height > MAX_HEIGHT
+
+
+def get_errors(path):
+    """Return the list of errors found in a thumbnail (that would prevent setting it)."""
+    info = get_image_info(path)
+    if not info:
+        return ["Thumbnail is not a JPEG or PNG image: {0}".format(path)]
+    errors = []
+    if os.path.getsize(path) > MAX_SIZE and not get_image_module():
+        errors.append("Thumbnail is larger than {0} MB (install Pillow to re-encode it): "
+                      "{1}".format(MAX_SIZE // (1024 * 1024), path))
+    return errors
+
+
+def get_warnings(path):
+    """Return the list of warnings of a thumbnail (it is set, but may look bad)."""
+    info = get_image_info(path)
+    if info and info[1] < MIN_WIDTH:
+        return ["Thumbnail is narrower than the {0} pixels recommended: {1} ({2}x{3})".format(
+            MIN_WIDTH, path, info[1], info[2])]
+    return []
+
+
+def get_source_hash(path):
+    """Return the hash (SHA-1) of the contents of a file."""
+    hasher = hashlib.sha1()
+    with open(path, "rb") as fd:
+        for data in iter(lambda: fd.read(64 * 1024), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def encode(path):
+    """Return the data of the image resized to fit MAX_WIDTH x MAX_HEIGHT as a JPEG."""
+    Image = get_image_module()
+    image = Image.open(path)
+    if image.mode in ("RGBA", "LA", "P"):
+        # JPEG has no transparency, draw the image on a white background
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((MAX_WIDTH, MAX_HEIGHT), Image.LANCZOS)
+    for quality in QUALITIES:
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+        if output.tell() <= MAX_SIZE:
+            return output.getvalue()
+    raise ThumbnailError("Cannot encode thumbnail in {0} bytes: {1}".format(MAX_SIZE, path))
+
+
+def prepare(path):
+    """
+    Return the path of the thumbnail to set: path itself if it can be sent
+    as is, or the processed JPEG (cached in the user cache directory).
+    """
+    info = get_image_info(path)
+    if not info or not needs_processing(path, info[1], info[2]):
+        return path
+    elif not get_image_module():
+        if os.path.getsize(path) > MAX_SIZE:
+            raise ThumbnailError("Thumbnail is larger than {0} MB (install Pillow to "
+                                 "re-encode it): {1}".format(MAX_SIZE // (1024 * 1024), path))
+        return path
+    directory = lib.get_cache_path("thumbnails")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    processed_path = os.path.join(directory, get_source_hash(path) + ".jpg")
+    if not os.path.exists(processed_path):
+        data = encode(path)
+        # Write to a temporary file, so a concurrent reader never gets a partial file
+        temp_path = "{0}.{1}.{2}.tmp".format(processed_path, os.getpid(),
+                                             threading.current_thread().ident)
+        with open(temp_path, "wb") as output:
+            output.write(data)
+        getattr(os, "replace", os.rename)(temp_path, processed_path)
+        lib.debug("Thumbnail re-encoded ({0} -> {1} bytes): {2}".format(
+            os.path.getsize(path), len(data), path))
+    return processed_path
+
+
+def prepare_in_background(path):
+    """
+    Return a Future of prepare(path) run in a background thread. A thumbnail
+    (by path and modification) is prepared once, even if set to several videos.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    with _jobs_lock:
+        if key not in _jobs:
+            _jobs[key] = _executor.submit(prepare, path)
+        return _jobs[key]
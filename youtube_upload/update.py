@@ -0,0 +1,84 @@
+"""
+Update the metadata of published videos: fetch their current state in
+videos.list calls of LIST_SIZE videos, compare it with the desired metadata,
+and send videos.update only for the videos (and parts) that changed.
+"""
+from . import lib
+from . import manifest
+
+# Videos per videos.list call (maximum of the API)
+LIST_SIZE = 50
+
+# Manifest column -> fields (part, name) of the video resource it sets
+FIELDS = {
+    "title": [("snippet", "title")],
+    "description": [("snippet", "description")],
+    "tags": [("snippet", "tags")],
+    "category": [("snippet", "categoryId")],
+    "privacy": [("status", "privacyStatus")],
+    # Scheduled videos must be private
+    "publish_at": [("status", "publishAt"), ("status", "privacyStatus")],
+}
+
+
+def get_videos(youtube, video_ids, parts):
+    """Return {video_id: resource} of video_ids (at most LIST_SIZE) with the parts."""
+    request = youtube.videos().list(id=",".join(video_ids), part=",".join(parts),
+                                    maxResults=LIST_SIZE)
+    return dict((item["id"], item) for item in lib.execute(request).get("items", []))
+
+
+def get_changes(body, columns):
+    """
+    Return the changes {part: {field: value}} of a video: the fields of the
+    manifest columns in body (a request body as built for uploads).
+    """
+    changes = {}
+    for column in columns:
+        for part, field in FIELDS.get(column, []):
+            changes.setdefault(part, {})[field] = _strip_empty(body[part][field])
+    return changes
+
+
+def _strip_empty(value):
+    # An empty column gives a list with an empty string (tags: [""])
+    return ([item for item in value if item] if isinstance(value, list) else value)
+
+
+def _normalize(field, value):
+    if field == "publishAt" and value:
+        date = manifest.parse_datetime(value)
+        if date.tzinfo:
+            date = (date - date.utcoffset()).replace(tzinfo=None)
+        return date
+    # Empty values (i.e. no tags) are missing in the resources of the API
+    return _strip_empty(value) or None
+
+
+def apply_changes(video, changes):
+    """
+    Return (body, parts): the request body to update video (a resource from
+    videos.list) with changes ({part: {field: value}}), and the parts that
+    changed (empty if the video is up to date).
+    """
+    body = dict(id=video["id"])
+    parts = []
+    for part, fields in sorted(changes.items()):
+        current = video.get(part, {})
+        if any(_normalize(field, current.get(field)) != _normalize(field, value)
+               for (field, value) in fields.items()):
+            # Parts are replaced, so they are sent complete (with the current fields)
+            body[part] = dict(current, **fields)
+            parts.append(part)
+    return body, parts
+
+
+def get_update_request(youtube, body, parts):
+    """Return the (not executed) request to update the parts of a video."""
+    return youtube.videos().update(part=",".join(parts), body=body)
+
+
+def update_video(youtube, body, parts):
+    """Update the parts of a video and return the response."""
+    lib.debug("Updating video {0}: {1}".format(body["id"], ", ".join(parts)))
+    return lib.execute(get_update_request(youtube, body, parts))
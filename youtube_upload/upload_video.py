@@ -1,4 +1,9 @@
+import os
+import sys
+import time
+import mmap
 import socket
+import threading
 
 try:
     import httplib
@@ -10,6 +15,10 @@ import apiclient.http
 import httplib2
 
 from . import lib
+from . import metrics
+from . import quota
+from .checksum import BackgroundHasher, ChecksumError, read_sidecar_checksum
+from .throttle import ThrottledFile
 
 RETRIABLE_EXCEPTIONS = [
     socket.error, IOError, httplib2.HttpLib2Error, httplib.NotConnected,
@@ -19,13 +28,183 @@ RETRIABLE_EXCEPTIONS = [
     googleapiclient.errors.HttpError,
 ]
 
+# Resumable uploads require chunk sizes multiple of 256 KiB
+CHUNK_MULTIPLE = 256 * 1024
 
-def _upload_to_request(request, progress_callback):
+# Bytes sent by a mapped upload between releases of its pages
+RELEASE_SIZE = 1024 * 1024
+
+# Bytes before the released offset released again (size of the largest folio)
+RELEASE_SLACK = 2 * 1024 * 1024
+
+
+# Set to stop the running uploads (see interrupt)
+_interrupted = threading.Event()
+
+
+class UploadInterrupted(Exception):
+    pass
+
+
+def interrupt():
+    """
+    Stop the running uploads after the chunk being sent: they raise
+    UploadInterrupted, and their sessions are kept in the journal.
+    """
+    _interrupted.set()
+
+
+class AdaptiveChunkSize(object):
+    """
+    Grow or shrink the chunk size so each chunk takes about target_time
+    seconds at the measured throughput. Sizes are kept between min_size and
+    max_size and change at most by a factor of 2 on every step.
+    """
+
+    def __init__(self, target_time=10.0, min_size=1024 * 1024, max_size=256 * 1024 * 1024):
+        self.target_time = target_time
+        self.min_size = max(CHUNK_MULTIPLE, min_size // CHUNK_MULTIPLE * CHUNK_MULTIPLE)
+        self.max_size = max(self.min_size, max_size // CHUNK_MULTIPLE * CHUNK_MULTIPLE)
+
+    def _bound(self, size):
+        size = int(size) // CHUNK_MULTIPLE * CHUNK_MULTIPLE
+        return max(self.min_size, min(self.max_size, size))
+
+    def get_initial(self, chunksize):
+        """Return the first chunk size to use."""
+        return self._bound(chunksize)
+
+    def get_next(self, chunksize, sent_bytes, elapsed):
+        """Return the chunk size to use after sending sent_bytes in elapsed seconds."""
+        if sent_bytes <= 0 or elapsed <= 0:
+            return chunksize
+        wanted = self.target_time * sent_bytes / elapsed
+        return self._bound(max(chunksize / 2, min(chunksize * 2, wanted)))
+
+    def get_after_error(self, chunksize):
+        """Return the chunk size to use after a failed chunk."""
+        return self._bound(chunksize / 2)
+
+
+class StreamMediaUpload(apiclient.http.MediaUpload):
+    """
+    Resumable upload of a stream of unknown size: a pipe or a file still being
+    written. Chunks wait until enough data is available; the upload finishes
+    at EOF if is_done is None (pipes), or at EOF once is_done() returns True
+    (growing files). Data not yet confirmed by the server is kept in memory.
+    """
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, fd, chunksize, is_done=None, poll_interval=1.0,
+                 mimetype="application/octet-stream"):
+        super(StreamMediaUpload, self).__init__()
+        self._fd = fd
+        self._chunksize = chunksize
+        self._is_done = is_done
+        self._poll_interval = poll_interval
+        self._mimetype = mimetype
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._done = False
+        self._finished = False
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        """Return the total size (None until the stream has finished)."""
+        return (self._buffer_start + len(self._buffer) if self._finished else None)
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def _read(self):
+        read = getattr(self._fd, "read1", self._fd.read)
+        data = read(self.READ_SIZE)
+        if data:
+            self._buffer.extend(data)
+        elif self._is_done is None or self._done:
+            self._finished = True
+        elif self._is_done():
+            # Read once more, data may have been written before the marker
+            self._done = True
+        else:
+            time.sleep(self._poll_interval)
+
+    def wait_chunk(self, begin):
+        """Wait until the chunk at offset begin is complete or the stream has finished."""
+        if begin < self._buffer_start:
+            raise ValueError("Cannot rewind stream to offset {0}".format(begin))
+        # Data before begin has been confirmed by the server
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+        # Wait for an extra byte, so a chunk of exactly chunksize bytes at EOF
+        # is known to be the last one before it is sent
+        while not self._finished and len(self._buffer) <= self._chunksize:
+            self._read()
+
+    def getbytes(self, begin, length):
+        self.wait_chunk(begin)
+        offset = begin - self._buffer_start
+        return bytes(self._buffer[offset:offset + length])
+
+    def close(self):
+        self._fd.close()
+
+
+def get_stream_media(path, chunksize, live=False):
+    """
+    Return the media of an upload of unknown size: standard input if path
+    is "-", or the file path being written (if live) until path.done exists.
+    """
+    if path == "-":
+        stdin = getattr(sys.stdin, "buffer", sys.stdin)
+        return StreamMediaUpload(stdin, chunksize)
+    else:
+        is_done = lambda: os.path.exists(path + ".done")
+        return StreamMediaUpload(open(path, "rb"), chunksize, is_done=is_done)
+
+
+def _set_chunksize(request, chunksize):
+    if chunksize != request.resumable.chunksize():
+        lib.debug("Chunk size: {0} KiB".format(chunksize // 1024))
+        request.resumable._chunksize = chunksize
+
+
+def _upload_to_request(request, progress_callback, chunk_callback=None,
+                       adaptive_chunksize=None):
     """Upload a video to a Youtube request. Return video ID."""
     while 1:
-        status, response = request.next_chunk()
+        if _interrupted.is_set():
+            raise UploadInterrupted("Upload interrupted")
+        if hasattr(request.resumable, "wait_chunk"):
+            # Streams of unknown size: the total size must be known before next_chunk
+            request.resumable.wait_chunk(request.resumable_progress)
+        chunksize = request.resumable.chunksize()
+        progress = request.resumable_progress
+        start_time = time.time()
+        try:
+            status, response = request.next_chunk()
+        except Exception:
+            if adaptive_chunksize:
+                _set_chunksize(request, adaptive_chunksize.get_after_error(chunksize))
+            raise
+        elapsed = time.time() - start_time
+        sent_bytes = (request.resumable.size() if response else request.resumable_progress) - progress
+        if adaptive_chunksize and status:
+            _set_chunksize(request,
+                           adaptive_chunksize.get_next(chunksize, sent_bytes, elapsed))
         if status and progress_callback:
             progress_callback(status.total_size, status.resumable_progress)
+        if chunk_callback:
+            chunk_callback(request, sent_bytes, elapsed)
         if response:
             if "id" in response:
                 return response['id']
@@ -33,13 +212,218 @@ def _upload_to_request(request, progress_callback):
                 raise KeyError("Expected field 'id' not found in response")
 
 
+def _resume_request(request, session):
+    """Continue the upload of request using a session stored in the journal."""
+    lib.debug("Resuming upload session ({0} bytes sent)".format(session["offset"]))
+    request.resumable_uri = session["uri"]
+    # In error state, the next chunk first asks the server for the committed range
+    request._in_error_state = True
+
+
+class MmapStream(object):
+    """
+    Read-only file object over a buffer, reads return memoryview slices (no
+    copies). The seek_callback, if given, is called with the new position,
+    and the read_callback with the position after every read.
+    """
+
+    def __init__(self, view, seek_callback=None, read_callback=None):
+        self.view = view
+        self.position = 0
+        self.seek_callback = seek_callback
+        self.read_callback = read_callback
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: len(self.view)}
+        self.position = base[whence] + offset
+        if self.seek_callback:
+            self.seek_callback(self.position)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = (len(self.view) if size < 0 else self.position + size)
+        data = self.view[self.position:end]
+        self.position += len(data)
+        if self.read_callback:
+            self.read_callback(self.position)
+        return data
+
+
+class MmapMediaUpload(apiclient.http.MediaUpload):
+    """
+    Resumable upload of a file mapped in memory. Chunks are sent as streams
+    read in small blocks, memoryview slices of the map, so the data is not
+    copied (neither on retries). Pages are dropped from memory as soon as
+    they are sent (every RELEASE_SIZE bytes), so the memory used does not
+    grow with the chunk size; a chunk sent again is read from the file.
+
+    If bucket (throttle.TokenBucket) is given, each block waits for the bucket.
+
+    If checksum (algorithm, hexdigest) is given, chunks are hashed in the
+    background as they are sent, and a ChecksumError is raised before the
+    last chunk is sent if the file does not match.
+    """
+
+    def __init__(self, path, chunksize, mimetype="application/octet-stream", bucket=None,
+                 checksum=None):
+        super(MmapMediaUpload, self).__init__()
+        self._chunksize = chunksize
+        self._mimetype = mimetype
+        self._fd = open(path, "rb")
+        self._size = os.fstat(self._fd.fileno()).st_size
+        # Empty files cannot be mapped
+        self._mmap = (mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+                      if self._size else None)
+        self._view = (memoryview(self._mmap) if self._mmap else memoryview(b""))
+        self._released = 0
+        self._checksum = checksum
+        self._hasher = (BackgroundHasher(checksum[0], self._get_data) if checksum else None)
+        self._verified = False
+        seek_callback = lambda offset: self._prepare_chunk(offset, self._chunksize)
+        stream = MmapStream(self._view, seek_callback, self._on_read)
+        self._stream = (ThrottledFile(stream, bucket) if bucket else stream)
+
+    def _get_data(self, begin, length):
+        return self._view[begin:begin + length]
+
+    def _verify(self):
+        algorithm, expected = self._checksum
+        hexdigest = self._hasher.get_hexdigest(self._size)
+        if hexdigest != expected:
+            raise ChecksumError("Checksum ({0}) mismatch: expected {1}, found {2}"
+                                .format(algorithm, expected, hexdigest))
+        lib.debug("Checksum ({0}) verified: {1}".format(algorithm, hexdigest))
+        self._verified = True
+
+    def _prepare_chunk(self, begin, length):
+        """Hash the chunk (verify the checksum before the last one) and drop sent pages."""
+        if self._hasher:
+            self._hasher.feed(begin, self._get_data(begin, length))
+            if begin + length >= self._size and not self._verified:
+                self._verify()
+        self._release_sent_pages(begin)
+
+    def _on_read(self, position):
+        if position - self._released >= RELEASE_SIZE:
+            self._release_sent_pages(position)
+
+    def _release_sent_pages(self, offset):
+        # Keep the pages not yet hashed, so the file is read once
+        self._release_pages(min(offset, self._hasher.offset) if self._hasher else offset)
+
+    def _release_pages(self, offset):
+        # mmap.madvise requires Python >= 3.8
+        if not hasattr(self._mmap, "madvise") or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        offset = offset // mmap.PAGESIZE * mmap.PAGESIZE
+        if offset > self._released:
+            # A page fault may map the whole (large) folio of the page cache,
+            # including released pages before it: release them again
+            begin = max(0, self._released - RELEASE_SLACK)
+            self._mmap.madvise(mmap.MADV_DONTNEED, begin, offset - begin)
+            self._released = offset
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return True
+
+    def stream(self):
+        return self._stream
+
+    def getbytes(self, begin, length):
+        self._prepare_chunk(begin, length)
+        return self._get_data(begin, length)
+
+    def close(self):
+        """Unmap and close the file."""
+        if self._hasher:
+            self._hasher.close()
+        self._view.release()
+        if self._mmap:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Slices still referenced, the map is closed when they are released
+                pass
+        self._fd.close()
+
+
 def upload(resource, path, body, chunksize=4 * 1024 * 1024,
-           progress_callback=None, max_retries=10):
-    """Upload video to Youtube. Return video ID."""
+           progress_callback=None, max_retries=10, journal=None, resume=False,
+           adaptive_chunksize=None, bucket=None, live=False):
+    """
+    Upload video to Youtube. Return video ID.
+
+    If a journal (journal.UploadJournal) is given, the session of the
+    upload is stored after every chunk. With resume, the upload continues
+    from the session stored in the journal for this same file, if any.
+
+    If adaptive_chunksize (AdaptiveChunkSize) is given, the chunk size changes
+    with the measured throughput of the upload.
+
+    If bucket (throttle.TokenBucket) is given, the upload rate is limited by it.
+
+    If path is "-", upload the standard input. With live, path is a file
+    still being written, uploaded until the file path.done exists. The size of
+    these uploads is unknown, so they cannot be resumed with a journal.
+
+    If a sidecar checksum file exists (see checksum.read_sidecar_checksum),
+    the file is verified during the upload (before the last chunk is sent).
+    """
     body_keys = ",".join(body.keys())
-    media = apiclient.http.MediaFileUpload(path, chunksize=chunksize,
-                                           resumable=True, mimetype="application/octet-stream")
+    if adaptive_chunksize:
+        chunksize = adaptive_chunksize.get_initial(chunksize)
+    if path == "-" or live:
+        media = get_stream_media(path, chunksize, live)
+        journal = None
+    else:
+        media = MmapMediaUpload(path, chunksize, bucket=bucket,
+                                checksum=read_sidecar_checksum(path))
     request = resource.videos().insert(part=body_keys, body=body, media_body=media)
-    upload_fun = lambda: _upload_to_request(request, progress_callback)
-    return lib.retriable_exceptions(upload_fun,
-                                    RETRIABLE_EXCEPTIONS, max_retries=max_retries)
+    journal_key = (journal.get_key(path) if journal else None)
+    session = (journal.get(journal_key) if journal and resume else None)
+    if session:
+        _resume_request(request, session)
+    else:
+        quota.charge("videos.insert")
+
+    def chunk_callback(request, sent_bytes, elapsed):
+        metrics.record("chunk", path=path, bytes=sent_bytes, seconds=elapsed)
+        if journal and request.resumable_uri:
+            journal.update(journal_key, request.resumable_uri, request.resumable_progress)
+
+    start_time = time.time()
+    upload_fun = lambda: _upload_to_request(request, progress_callback, chunk_callback,
+                                            adaptive_chunksize)
+    try:
+        video_id = lib.retriable_exceptions(upload_fun,
+                                            RETRIABLE_EXCEPTIONS, max_retries=max_retries)
+    except googleapiclient.errors.HttpError as exc:
+        if not session or exc.resp.status not in (404, 410):
+            raise
+        lib.debug("Upload session has expired, starting a new one")
+        request = resource.videos().insert(part=body_keys, body=body, media_body=media)
+        quota.charge("videos.insert")
+        video_id = lib.retriable_exceptions(upload_fun,
+                                            RETRIABLE_EXCEPTIONS, max_retries=max_retries)
+    finally:
+        media.close()
+    if journal:
+        journal.remove(journal_key)
+    metrics.record("upload", path=path, video_id=video_id, bytes=media.size(),
+                   seconds=time.time() - start_time)
+    return video_id